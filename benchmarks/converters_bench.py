@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""converters_bench.py
+
+Micro-benchmark of the precompiled converters.FormMapper against the
+per-call all_fields() reflection the _copy*ToForm helpers used to do.
+Prints one JSON line per (form, implementation).
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/converters_bench.py -n 1000
+
+"""
+
+import argparse
+import json
+import time
+from datetime import date, datetime
+
+import gae_env
+gae_env.setup()
+
+from google.appengine.ext import ndb
+
+import converters
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import TeeShirtSize
+
+
+# - - - the helpers as they were before converters.py - - - - - - - - -
+def legacyCopyConferenceToForm(conf):
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def legacyCopyProfileToForm(prof):
+    pf = ProfileForm()
+    for field in pf.all_fields():
+        if hasattr(prof, field.name):
+            if field.name == 'teeShirtSize':
+                setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
+            else:
+                setattr(pf, field.name, getattr(prof, field.name))
+    pf.check_initialized()
+    return pf
+
+
+def legacyCopySessionToForm(session):
+    cs = SessionForm()
+    for field in cs.all_fields():
+        if hasattr(session, field.name):
+            if field.name.endswith('date'):
+                setattr(cs, field.name, str(getattr(session, field.name)))
+            elif field.name.endswith('Time'):
+                setattr(cs, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(cs, field.name, getattr(session, field.name))
+        elif field.name == "websafeKey":
+            setattr(cs, field.name, session.key.urlsafe())
+    cs.check_initialized()
+    return cs
+
+
+# - - - fixtures - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def makeConferences(n):
+    return [Conference(key=ndb.Key(Profile, 'user%d' % (i % 50), Conference, i + 1),
+                       name='Conference %d' % i, description='About %d' % i,
+                       organizerUserId='user%d' % (i % 50),
+                       topics=['Web', 'Cloud'], city='London',
+                       startDate=date(2016, 1 + i % 12, 1), month=1 + i % 12,
+                       endDate=date(2016, 1 + i % 12, 3), maxAttendees=100,
+                       seatsAvailable=i % 100, organizerDisplayName='User')
+            for i in range(n)]
+
+
+def makeProfiles(n):
+    return [Profile(key=ndb.Key(Profile, 'user%d' % i), displayName='User %d' % i,
+                    mainEmail='user%d@example.com' % i, teeShirtSize='M_W',
+                    sessionKeysToAttend=['a', 'b'])
+            for i in range(n)]
+
+
+def makeSessions(n):
+    return [Session(key=ndb.Key(Conference, 1, Session, i + 1),
+                    name='Session %d' % i, highlights='Stuff', speaker='Speaker',
+                    duration='1h', typeOfSession='lecture',
+                    date=date(2016, 5, 1), startTime=datetime(2016, 5, 1, 9).time(),
+                    websafeConferenceKey='x')
+            for i in range(n)]
+
+
+def timeIt(func, entities, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        forms = [func(entity) for entity in entities]
+        elapsed = time.time() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, forms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-n', type=int, default=1000, help='entities per form')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    cases = [
+        ('ConferenceForm', makeConferences(args.n), legacyCopyConferenceToForm,
+         converters.mapper(Conference, ConferenceForm)),
+        ('ProfileForm', makeProfiles(args.n), legacyCopyProfileToForm,
+         converters.mapper(Profile, ProfileForm)),
+        ('SessionForm', makeSessions(args.n), legacyCopySessionToForm,
+         converters.mapper(Session, SessionForm)),
+    ]
+    for name, entities, legacy, mapper in cases:
+        legacy_secs, legacy_forms = timeIt(legacy, entities, args.repeat)
+        mapper_secs, mapper_forms = timeIt(mapper.copy, entities, args.repeat)
+        assert legacy_forms == mapper_forms, '%s: mapper output differs' % name
+        for impl, secs in (('reflection', legacy_secs), ('mapper', mapper_secs)):
+            print(json.dumps({
+                'form': name,
+                'impl': impl,
+                'entities': args.n,
+                'seconds': round(secs, 6),
+                'usPerEntity': round(secs * 1e6 / args.n, 2),
+            }))
+
+
+if __name__ == '__main__':
+    main()
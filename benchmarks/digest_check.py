@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""digest_check.py
+
+Runs the confirmation digest worker against the local taskqueue and mail
+stubs: queues -n confirmations spread over -u organizers, drains the pull
+queue & prints one JSON line with the notifications handled, the messages
+the mail stub received and the messages sent per worker run.
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/digest_check.py -n 2000 -u 50
+
+"""
+
+import argparse
+import json
+import time
+
+import gae_env
+gae_env.setup()
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import testbed
+
+import notifications
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-n', type=int, default=2000, help='confirmations to queue')
+    parser.add_argument('-u', '--users', type=int, default=50, help='distinct organizers')
+    args = parser.parse_args()
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_app_identity_stub()
+    tb.init_memcache_stub()
+    tb.init_mail_stub()
+    tb.init_taskqueue_stub(root_path=gae_env.APP_ROOT)
+    try:
+        queue = taskqueue.Queue(notifications.CONFIRMATION_QUEUE)
+        tasks = [notifications.confirmation_task('user%d@example.com' % (i % args.users),
+                                                 'Conference %d' % i)
+                 for i in range(args.n)]
+        for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD):
+            queue.add(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+
+        runs, handled, started = 0, 0, time.time()
+        while handled < args.n:
+            stats = notifications.send_digests()
+            if not stats['notifications']:
+                break
+            runs += 1
+            handled += stats['notifications']
+        elapsed = time.time() - started
+
+        mails = tb.get_stub(testbed.MAIL_SERVICE_NAME).get_sent_messages()
+        assert handled == args.n, 'only %d of %d confirmations sent' % (handled, args.n)
+        print(json.dumps({
+            'notifications': handled,
+            'messagesSent': len(mails),
+            'workerRuns': runs,
+            'messagesPerRun': round(float(len(mails)) / max(runs, 1), 2),
+            'seconds': round(elapsed, 3),
+        }))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+
+"""endpoints_bench.py
+
+Benchmarks every ConferenceApi endpoint, plus the announcement and
+featured speaker helpers, against the testbed datastore, memcache,
+taskqueue and search stubs, with no network. Seeds conferences, sessions and profiles
+with registrations and wish lists, then calls each endpoint -i times as
+random users. Prints one JSON line per endpoint with its latency
+percentiles & API RPCs per call. The first line describes the run (seed
+sizes, git commit), so outputs of two commits can be compared.
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/endpoints_bench.py \\
+        --conferences 10000 --sessions 100000 --profiles 50000 > results.jsonl
+
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import gae_env
+gae_env.setup()
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+import conference
+import facets
+import searchindex
+import seats
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import Profile
+from models import ProfileMiniForm
+from models import Registration
+from models import Session
+from models import SessionForm
+from models import SessionQueryForm
+from models import SessionQueryForms
+from models import Speaker
+from models import TeeShirtSize
+
+CITIES = ['London', 'Paris', 'Tokyo', 'San Francisco', 'Berlin', 'Chicago',
+          'Sydney', 'Toronto', 'Bangalore', 'Sao Paulo']
+TOPICS = ['Web Technologies', 'Programming Languages', 'Movie Making',
+          'Health and Nutrition', 'Medical Innovations', 'Cloud', 'Mobile']
+SESSION_TYPES = ['lecture', 'keynote', 'workshop', 'panel']
+START_HOURS = [9, 10, 11, 13, 14, 16, 18, 19, 20]
+PUT_BATCH = 500
+VOID = message_types.VoidMessage
+
+
+def request(container, **fields):
+    """Return the request message of an endpoints ResourceContainer."""
+    return container.combined_message_class(**fields)
+
+
+def userEmail(i):
+    return 'user%d@example.com' % i
+
+
+# - - - seeding - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def putAll(entities):
+    for i in range(0, len(entities), PUT_BATCH):
+        ndb.put_multi(entities[i:i + PUT_BATCH], use_cache=False, use_memcache=False)
+
+
+def seed(args, rnd):
+    """Write the fixture data; returns what the endpoint cases pick from."""
+    organizers = max(1, args.profiles // 50)
+    speakers = ['Speaker %d' % i for i in range(max(1, args.sessions // 20))]
+    start = date(2017, 1, 1)
+
+    conferences = []
+    for i in range(args.conferences):
+        organizer = userEmail(i % organizers)
+        startDate = start + timedelta(days=rnd.randint(0, 364))
+        form = ConferenceForm(name='Conference %d' % i,
+                              description='All about topic %d' % i,
+                              topics=rnd.sample(TOPICS, 2),
+                              city=rnd.choice(CITIES),
+                              startDate=str(startDate),
+                              endDate=str(startDate + timedelta(days=2)),
+                              maxAttendees=rnd.choice([50, 200, 1000]))
+        key = ndb.Key(Profile, organizer, Conference, i + 1)
+        conf = ConferenceApi._conferenceFromForm(form, organizer, key)
+        conf.organizerDisplayName = organizer
+        conferences.append(conf)
+
+    sessions = []
+    for i in range(args.sessions):
+        conf = conferences[i % len(conferences)]
+        form = SessionForm(name='Session %d' % i, highlights='Highlights of %d' % i,
+                           speaker=rnd.choice(speakers),
+                           duration='1h', typeOfSession=rnd.choice(SESSION_TYPES),
+                           date='%s %02d:00:00' % (conf.startDate, rnd.choice(START_HOURS)))
+        session = ConferenceApi._sessionFromForm(
+            form, conf, conf.organizerUserId,
+            ndb.Key(Session, i + 1, parent=conf.key))
+        session.speakerPending = None
+        sessions.append(session)
+
+    bySpeaker = {}
+    for session in sessions:
+        bySpeaker.setdefault(session.speakerKey, []).append(session)
+    speakerEntities = [Speaker(key=speakerKey, name=group[0].speaker,
+                               sessionKeys=[s.key for s in group])
+                       for speakerKey, group in bySpeaker.items()]
+
+    profiles, registrations = [], []
+    taken = {}
+    for i in range(args.profiles):
+        p_key = ndb.Key(Profile, userEmail(i))
+        wishlist = rnd.sample(sessions, min(args.wishlist, len(sessions)))
+        profiles.append(Profile(key=p_key, displayName='User %d' % i,
+                                mainEmail=userEmail(i),
+                                teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),
+                                sessionKeysToAttend=[s.key.urlsafe() for s in wishlist]))
+        for conf in rnd.sample(conferences, min(args.registrations, len(conferences))):
+            if taken.get(conf.key, 0) < conf.maxAttendees:
+                taken[conf.key] = taken.get(conf.key, 0) + 1
+                registrations.append(Registration(
+                    key=ConferenceApi._registrationKey(p_key, conf.key.urlsafe()),
+                    conferenceKey=conf.key))
+
+    shards = []
+    for conf in conferences:
+        conf.seatsAvailable -= taken.get(conf.key, 0)
+        shards.extend(seats.new_shards(conf.key, conf.seatsAvailable))
+
+    started = time.time()
+    for entities in (profiles, conferences, shards, sessions, speakerEntities, registrations):
+        putAll(entities)
+    searchindex.index_conferences(conferences)
+    searchindex.index_sessions(sessions)
+    facets.count_conferences([conf.key.urlsafe() for conf in conferences])
+    ConferenceApi._checkAnnouncement()
+    return {
+        'conferences': conferences,
+        'sessions': sessions,
+        'speakers': speakers,
+        'profiles': args.profiles,
+        'organizers': organizers,
+        'seedSeconds': round(time.time() - started, 1),
+    }
+
+
+# - - - measuring - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+class RpcCounter(object):
+    """Counts API calls by service.method while active."""
+
+    def __init__(self):
+        self.counts = None
+
+    def __call__(self, service, call, request, response):
+        if self.counts is not None:
+            name = '%s.%s' % (service, call)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))]
+
+
+def measure(name, call, data, args, rnd, counter):
+    """Run call(data, rnd) -i times as random users; return a result dict."""
+    latencies, totals, errors = [], {}, 0
+    for _ in range(args.iterations):
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = userEmail(rnd.randrange(data['profiles']))
+        # each call is a new request: empty in-context cache, new service
+        ndb.get_context().clear_cache()
+        counter.counts = {}
+        started = time.time()
+        try:
+            call(data, rnd)
+        except endpoints.ServiceException:
+            errors += 1
+        latencies.append((time.time() - started) * 1000)
+        for rpc, count in counter.counts.items():
+            totals[rpc] = totals.get(rpc, 0) + count
+        counter.counts = None
+    return {
+        'endpoint': name,
+        'iterations': args.iterations,
+        'errors': errors,
+        'meanMs': round(sum(latencies) / len(latencies), 2),
+        'p50Ms': round(percentile(latencies, 50), 2),
+        'p95Ms': round(percentile(latencies, 95), 2),
+        'maxMs': round(max(latencies), 2),
+        'rpcsPerCall': dict((rpc, round(float(count) / args.iterations, 2))
+                            for rpc, count in sorted(totals.items())),
+    }
+
+
+def anyConf(data, rnd):
+    return rnd.choice(data['conferences']).key.urlsafe()
+
+
+def ownConf(data, rnd):
+    """Pick a conference & act as its organizer."""
+    conf = rnd.choice(data['conferences'])
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = conf.organizerUserId
+    return conf.key.urlsafe()
+
+
+def newSessionForm(data, rnd, i=0):
+    return SessionForm(name='Bench session %d' % i, speaker=rnd.choice(data['speakers']),
+                       typeOfSession=rnd.choice(SESSION_TYPES), duration='1h',
+                       date='2017-06-01 %02d:00:00' % rnd.choice(START_HOURS))
+
+
+def wishlistKey(data, rnd):
+    return rnd.choice(data['sessions']).key.urlsafe()
+
+
+def confDate(data, rnd):
+    return str(rnd.choice(data['conferences']).startDate)
+
+
+CASES = [
+    ('getConference', lambda d, r: ConferenceApi().getConference(
+        request(conference.CONF_GET_REQUEST, websafeConferenceKey=anyConf(d, r)))),
+    ('getConferencesCreated', lambda d, r: (
+        ownConf(d, r), ConferenceApi().getConferencesCreated(VOID()))),
+    ('queryConferences', lambda d, r: ConferenceApi().queryConferences(
+        ConferenceQueryForms(pageSize=20))),
+    ('queryConferencesByCity', lambda d, r: ConferenceApi().queryConferences(
+        ConferenceQueryForms(filters=[ConferenceQueryForm(
+            field='CITY', operator='EQ', value=r.choice(CITIES))], pageSize=20))),
+    ('getConferenceFacets', lambda d, r: ConferenceApi().getConferenceFacets(VOID())),
+    ('searchConferences', lambda d, r: ConferenceApi().searchConferences(
+        request(conference.SEARCH_REQUEST, query=r.choice(CITIES), pageSize=20))),
+    ('getConferencesToAttend', lambda d, r: ConferenceApi().getConferencesToAttend(
+        request(conference.PAGE_GET_REQUEST, pageSize=20))),
+    ('isRegisteredForConference', lambda d, r: ConferenceApi().isRegisteredForConference(
+        request(conference.CONF_GET_REQUEST, websafeConferenceKey=anyConf(d, r)))),
+    ('getConferenceAttendees', lambda d, r: ConferenceApi().getConferenceAttendees(
+        request(conference.CONF_PAGE_GET_REQUEST, websafeConferenceKey=ownConf(d, r),
+                pageSize=20))),
+    ('registerForConference', lambda d, r: ConferenceApi().registerForConference(
+        request(conference.CONF_GET_REQUEST, websafeConferenceKey=anyConf(d, r)))),
+    ('unregisterFromConference', lambda d, r: ConferenceApi().unregisterFromConference(
+        request(conference.CONF_GET_REQUEST, websafeConferenceKey=anyConf(d, r)))),
+    ('getProfile', lambda d, r: ConferenceApi().getProfile(VOID())),
+    ('saveProfile', lambda d, r: ConferenceApi().saveProfile(
+        ProfileMiniForm(displayName='Renamed %d' % r.randrange(1000),
+                        teeShirtSize=TeeShirtSize.M_M))),
+    ('getAnnouncement', lambda d, r: ConferenceApi().getAnnouncement(VOID())),
+    ('_cacheAnnouncement', lambda d, r: ConferenceApi._cacheAnnouncement()),
+    ('filterPlayground', lambda d, r: ConferenceApi().filterPlayground(VOID())),
+    ('createConference', lambda d, r: ConferenceApi().createConference(
+        ConferenceForm(name='Bench conference', city=r.choice(CITIES),
+                       topics=[r.choice(TOPICS)], startDate='2017-06-01',
+                       maxAttendees=100))),
+    ('updateConference', lambda d, r: ConferenceApi().updateConference(
+        request(conference.CONF_POST_REQUEST, websafeConferenceKey=ownConf(d, r),
+                name='Updated conference', city=r.choice(CITIES)))),
+    ('createSession', lambda d, r: ConferenceApi().createSession(
+        request(conference.SESSION_POST_REQUEST, websafeConferenceKey=ownConf(d, r),
+                **dict((f.name, getattr(newSessionForm(d, r), f.name))
+                       for f in SessionForm.all_fields())))),
+    ('createSessions', lambda d, r: ConferenceApi().createSessions(
+        request(conference.SESSIONS_POST_REQUEST, websafeConferenceKey=ownConf(d, r),
+                items=[newSessionForm(d, r, i) for i in range(20)]))),
+    ('getConferenceSessions', lambda d, r: ConferenceApi().getConferenceSessions(
+        request(conference.SESSION_GET_REQUEST, websafeConferenceKey=anyConf(d, r)))),
+    ('getConferenceSessionsByType', lambda d, r: ConferenceApi().getConferenceSessionsByType(
+        request(conference.SESSION_TYPE_GET_REQUEST, websafeConferenceKey=anyConf(d, r),
+                typeOfSession=r.choice(SESSION_TYPES)))),
+    ('getSessionsBySpeaker', lambda d, r: ConferenceApi().getSessionsBySpeaker(
+        request(conference.SESSION_SPEAKER_GET_REQUEST, speaker=r.choice(d['speakers'])))),
+    ('getSessionsByDate', lambda d, r: ConferenceApi().getSessionsByDate(
+        request(conference.SESSION_Date_GET_REQUEST, date=confDate(d, r)))),
+    ('getMorningSessionsByDate', lambda d, r: ConferenceApi().getMorningSessionsByDate(
+        request(conference.SESSION_DATE_PAGE_GET_REQUEST, date=confDate(d, r), pageSize=20))),
+    ('getNonWorkshopSessionsBeforeSevenPM',
+     lambda d, r: ConferenceApi().getNonWorkshopSessionsBeforeSevenPM(
+         request(conference.PAGE_GET_REQUEST, pageSize=20))),
+    ('querySessions', lambda d, r: ConferenceApi().querySessions(
+        SessionQueryForms(filters=[
+            SessionQueryForm(field='TYPE', operator='EQ', value=r.choice(SESSION_TYPES)),
+            SessionQueryForm(field='START_TIME', operator='LT', value='19:00')],
+            pageSize=20))),
+    ('searchSessions', lambda d, r: ConferenceApi().searchSessions(
+        request(conference.SESSION_SEARCH_REQUEST,
+                query='speaker:"%s"' % r.choice(d['speakers']), pageSize=20))),
+    ('addSessionToWishlist', lambda d, r: ConferenceApi().addSessionToWishlist(
+        request(conference.WISHLIST_GET_REQUEST, SessionKey=wishlistKey(d, r)))),
+    ('getSessionsInWishlist', lambda d, r: ConferenceApi().getSessionsInWishlist(VOID())),
+    ('deleteSessionInWishlist', lambda d, r: ConferenceApi().deleteSessionInWishlist(
+        request(conference.WISHLIST_GET_REQUEST, SessionKey=wishlistKey(d, r)))),
+    ('getFeaturedSpeaker', lambda d, r: ConferenceApi().getFeaturedSpeaker(
+        request(conference.CONF_GET_REQUEST, websafeConferenceKey=anyConf(d, r)))),
+    ('_refreshFeaturedSpeaker', lambda d, r: ConferenceApi._refreshFeaturedSpeaker(
+        anyConf(d, r))),
+]
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=gae_env.APP_ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--conferences', type=int, default=10000)
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--profiles', type=int, default=50000)
+    parser.add_argument('--registrations', type=int, default=3,
+                        help='conferences each profile is registered for')
+    parser.add_argument('--wishlist', type=int, default=5,
+                        help='sessions in each profile\'s wish list')
+    parser.add_argument('-i', '--iterations', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', nargs='*', help='endpoint names to run')
+    args = parser.parse_args()
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=gae_env.APP_ROOT)
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_urlfetch_stub()
+    tb.init_search_stub()
+    tb.init_user_stub()
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'example.com'
+    try:
+        rnd = random.Random(args.seed)
+        data = seed(args, rnd)
+        print(json.dumps({
+            'commit': gitCommit(),
+            'conferences': args.conferences,
+            'sessions': args.sessions,
+            'profiles': args.profiles,
+            'registrations': args.registrations,
+            'wishlist': args.wishlist,
+            'iterations': args.iterations,
+            'seedSeconds': data['seedSeconds'],
+        }))
+        sys.stdout.flush()
+
+        counter = RpcCounter()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('bench', counter)
+        for name, call in CASES:
+            if args.only and name not in args.only:
+                continue
+            print(json.dumps(measure(name, call, data, args, rnd, counter)))
+            sys.stdout.flush()
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""facets_check.py
+
+Runs the city/topic/month facet counters against the local datastore,
+memcache and taskqueue stubs. Creates -c conferences through the API,
+moves some to another city, deletes some, then runs the queued
+/tasks/count_facets work and checks getConferenceFacets against a scan of
+the Conference kind. It wipes the counters and checks the backfill
+(recount_batch) rebuilds them too. Prints one JSON line with the counts
+and how long the runs took.
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/facets_check.py -c 500
+
+"""
+
+import argparse
+import json
+import time
+
+import gae_env
+gae_env.setup()
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+import conference
+import facets
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import CountedFacets
+from models import FacetCount
+from models import Profile
+from models import TeeShirtSize
+
+ORGANIZER = 'organizer@example.com'
+CITIES = ['London', 'Paris', 'Tokyo', 'Berlin', 'Chicago']
+TOPICS = ['Cloud', 'Mobile', 'Web Technologies', 'Programming Languages']
+
+
+def api():
+    result = ConferenceApi()
+    result._currentUser = (users.User(ORGANIZER, _auth_domain='example.com'), ORGANIZER)
+    return result
+
+
+def runCountTasks(tb):
+    """Run the queued /tasks/count_facets tasks, & those they queue, the
+    way CountFacetsHandler would; returns how many ran."""
+    stub = tb.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+    ran = 0
+    while True:
+        tasks = stub.get_filtered_tasks(url='/tasks/count_facets')
+        if not tasks:
+            return ran
+        stub.FlushQueue('default')
+        for task in tasks:
+            params = task.extract_params()
+            if params.get('websafeConferenceKeys'):
+                facets.count_conferences(params['websafeConferenceKeys'].split(','))
+            else:
+                cursor = facets.recount_batch(params.get('cursor') or None)
+                if cursor:
+                    taskqueue.add(url='/tasks/count_facets', params={'cursor': cursor})
+            ran += 1
+
+
+def expected():
+    """Return {facet: {value: count}} from a scan of every Conference."""
+    counts = dict((facet, {}) for facet in facets.FACETS)
+    for conf in Conference.query():
+        for f in facets.facet_ids(conf):
+            facet, value = f.split(':', 1)
+            counts[facet][value] = counts[facet].get(value, 0) + 1
+    return counts
+
+
+def served():
+    """Return {facet: {value: count}} from the getConferenceFacets endpoint."""
+    form = ConferenceApi().getConferenceFacets(message_types.VoidMessage())
+    return {
+        'city': dict((v.value, v.count) for v in form.cities),
+        'topic': dict((v.value, v.count) for v in form.topics),
+        'month': dict((v.value, v.count) for v in form.months),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-c', '--conferences', type=int, default=500)
+    parser.add_argument('--moved', type=int, default=50, help='conferences moved to Sydney')
+    parser.add_argument('--deleted', type=int, default=20)
+    args = parser.parse_args()
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=gae_env.APP_ROOT)
+    tb.init_search_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    try:
+        Profile(id=ORGANIZER, displayName='Organizer', mainEmail=ORGANIZER,
+                teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED)).put()
+        for i in range(args.conferences):
+            api().createConference(ConferenceForm(
+                name='Conference %d' % i, city=CITIES[i % len(CITIES)],
+                topics=[TOPICS[i % len(TOPICS)], TOPICS[(i // 2) % len(TOPICS)]],
+                startDate='2017-%02d-01' % (i % 12 + 1), maxAttendees=100))
+        keys = Conference.query(ancestor=ndb.Key(Profile, ORGANIZER)).order(
+            Conference.key).fetch(keys_only=True)
+        for c_key in keys[:args.moved]:
+            api().updateConference(conference.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=c_key.urlsafe(), city='Sydney'))
+        # there's no delete endpoint; a delete queues the same count task
+        deleted = keys[-args.deleted:] if args.deleted else []
+        ndb.delete_multi(deleted)
+        if deleted:
+            facets.count_task([k.urlsafe() for k in deleted]).add()
+
+        started = time.time()
+        tasks = runCountTasks(tb)
+        countSeconds = time.time() - started
+        want = expected()
+        assert served() == want, 'counts after writes differ: %r != %r' % (served(), want)
+
+        # rebuild from scratch through the backfill
+        ndb.delete_multi(FacetCount.query().fetch(keys_only=True) +
+                         CountedFacets.query().fetch(keys_only=True))
+        memcache.delete(facets.MEMCACHE_FACETS_KEY)
+        taskqueue.add(url='/tasks/count_facets')
+        started = time.time()
+        backfillTasks = runCountTasks(tb)
+        backfillSeconds = time.time() - started
+        assert served() == want, 'counts after backfill differ: %r != %r' % (served(), want)
+
+        print(json.dumps({
+            'conferences': args.conferences - len(deleted),
+            'moved': args.moved,
+            'deleted': len(deleted),
+            'cities': len(want['city']),
+            'topics': len(want['topic']),
+            'months': len(want['month']),
+            'countTasks': tasks,
+            'countSeconds': round(countSeconds, 3),
+            'backfillTasks': backfillTasks,
+            'backfillSeconds': round(backfillSeconds, 3),
+        }))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
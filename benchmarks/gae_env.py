@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+
+"""gae_env.py
+
+Puts the App Engine SDK and the app on sys.path so benchmark scripts can
+run outside dev_appserver. Point GAE_SDK at the SDK directory (the one
+holding dev_appserver.py) if it isn't importable already.
+
+"""
+
+import os
+import sys
+
+APP_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup(app_id='conference-bench'):
+    """Make the SDK, its bundled libraries and the app importable."""
+    sdk = os.environ.get('GAE_SDK')
+    if sdk and sdk not in sys.path:
+        sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    if APP_ROOT not in sys.path:
+        sys.path.insert(0, APP_ROOT)
+    os.environ.setdefault('APPLICATION_ID', app_id)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+"""registration_stress.py
+
+Launch-day contention on the local datastore stub. -t threads register
+and unregister their own users against -c conferences through the
+registerForConference/unregisterFromConference endpoints, while -u
+organizer threads keep raising maxAttendees through updateConference.
+The datastore stub simulates HRD consistency. Prints one JSON line with
+committed registrations per second, transaction attempts, retries &
+aborts, and whether every conference's seats still add up.
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/registration_stress.py -t 32 -c 3
+
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+
+import gae_env
+gae_env.setup()
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import datastore_errors
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+import seats
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import TeeShirtSize
+
+
+class Counters(object):
+    """Thread-safe tallies of what the workers saw."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, n=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + n
+
+    def get(self, name):
+        return self.values.get(name, 0)
+
+    def before(self, service, call, request, response):
+        """apiproxy pre-call hook: counts transaction attempts & rollbacks."""
+        if call == 'BeginTransaction':
+            self.add('txnAttempts')
+        elif call == 'Rollback':
+            self.add('txnRollbacks')
+
+    def after(self, service, call, request, response):
+        """apiproxy post-call hook; only runs for calls that succeeded."""
+        if call == 'Commit':
+            self.add('txnCommits')
+
+
+def apiAs(email):
+    """Return a ConferenceApi acting as email, skipping endpoints auth
+    (os.environ is shared between the worker threads here)."""
+    api = ConferenceApi()
+    api._currentUser = (users.User(email, _auth_domain='example.com'), email)
+    return api
+
+
+def seed(args):
+    organizer = 'organizer@example.com'
+    Profile(id=organizer, displayName='Organizer', mainEmail=organizer,
+            teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED)).put()
+    api = apiAs(organizer)
+    keys = []
+    for i in range(args.conferences):
+        form = api.createConference(ConferenceForm(
+            name='Launch %d' % i, city='London', topics=['Cloud'],
+            startDate='2017-06-01', maxAttendees=args.seats))
+        keys.append(Conference.query(ancestor=ndb.Key(Profile, organizer))
+                    .filter(Conference.name == form.name).get().key)
+    users_ = []
+    for t in range(args.threads):
+        emails = ['user%d-%d@example.com' % (t, i) for i in range(args.users_per_thread)]
+        ndb.put_multi([Profile(id=e, displayName=e, mainEmail=e,
+                               teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED))
+                       for e in emails])
+        users_.append(emails)
+    return organizer, keys, users_
+
+
+def registrant(emails, confKeys, args, counters, registered, rnd):
+    """Toggle random (user, conference) registrations for args.seconds."""
+    deadline = time.time() + args.seconds
+    while time.time() < deadline:
+        email = rnd.choice(emails)
+        c_key = rnd.choice(confKeys)
+        request = conference.CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=c_key.urlsafe())
+        mine = registered.setdefault(email, set())
+        try:
+            if c_key in mine and rnd.random() < args.unregister:
+                if apiAs(email).unregisterFromConference(request).data:
+                    mine.discard(c_key)
+                    counters.add('unregistrations')
+            elif c_key not in mine:
+                if apiAs(email).registerForConference(request).data:
+                    mine.add(c_key)
+                    counters.add('registrations')
+        except endpoints.ServiceException:
+            # sold out
+            counters.add('rejected')
+        except datastore_errors.TransactionFailedError:
+            counters.add('aborts')
+        counters.add('operations')
+
+
+def updater(organizer, confKeys, args, counters, rnd):
+    """Keep adding seats to random conferences through updateConference."""
+    deadline = time.time() + args.seconds
+    while time.time() < deadline:
+        c_key = rnd.choice(confKeys)
+        conf = c_key.get(use_cache=False, use_memcache=False)
+        request = conference.CONF_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=c_key.urlsafe(), maxAttendees=conf.maxAttendees + 1)
+        try:
+            apiAs(organizer).updateConference(request)
+            counters.add('updates')
+        except datastore_errors.TransactionFailedError:
+            counters.add('aborts')
+        counters.add('operations')
+        time.sleep(args.update_pause)
+
+
+def check(confKeys, registered):
+    """Return per-conference seat accounting; ok when seats left plus
+    seats taken equals maxAttendees and the synced count agrees."""
+    result = []
+    for c_key in confKeys:
+        conf = c_key.get(use_cache=False, use_memcache=False)
+        shards = ndb.get_multi(seats.shard_keys(c_key, conf.seatShards),
+                               use_cache=False, use_memcache=False)
+        left = sum(s.seats for s in shards)
+        taken = sum(1 for confs in registered.values() if c_key in confs)
+        stored = len([r for r in ndb.get_multi(
+            [ConferenceApi._registrationKey(ndb.Key(Profile, email), c_key.urlsafe())
+             for email, confs in registered.items()], use_cache=False, use_memcache=False) if r])
+        synced = seats.sync_seats(c_key).seatsAvailable
+        result.append({
+            'conference': conf.name,
+            'maxAttendees': conf.maxAttendees,
+            'seatsLeft': left,
+            'registered': taken,
+            'registrationEntities': stored,
+            'syncedSeatsAvailable': synced,
+            'ok': left + taken == conf.maxAttendees and stored == taken and synced == left,
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-t', '--threads', type=int, default=16)
+    parser.add_argument('-c', '--conferences', type=int, default=3)
+    parser.add_argument('-u', '--updaters', type=int, default=1)
+    parser.add_argument('--seats', type=int, default=200, help='maxAttendees per conference')
+    parser.add_argument('--users-per-thread', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--unregister', type=float, default=0.3,
+                        help='chance of unregistering when already registered')
+    parser.add_argument('--update-pause', type=float, default=0.2)
+    parser.add_argument('--consistency', type=float, default=0.5,
+                        help='HRD policy: chance a write is visible to queries at once')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=args.consistency, seed=args.seed))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=gae_env.APP_ROOT)
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    try:
+        organizer, confKeys, users_ = seed(args)
+        counters = Counters()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'stress', counters.before, 'datastore_v3')
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'stress', counters.after, 'datastore_v3')
+
+        registered = {}
+        threads = [threading.Thread(target=registrant,
+                                    args=(emails, confKeys, args, counters, registered,
+                                          random.Random(args.seed + i)))
+                   for i, emails in enumerate(users_)]
+        threads += [threading.Thread(target=updater,
+                                     args=(organizer, confKeys, args, counters,
+                                           random.Random(-args.seed - i)))
+                    for i in range(args.updaters)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        # a failed commit is a conflict; ndb retries it unless it gives up
+        conflicts = (counters.get('txnAttempts') - counters.get('txnCommits') -
+                     counters.get('txnRollbacks'))
+        conferences = check(confKeys, registered)
+        print(json.dumps({
+            'threads': args.threads,
+            'conferences': args.conferences,
+            'updaters': args.updaters,
+            'seconds': round(elapsed, 2),
+            'operations': counters.get('operations'),
+            'registrations': counters.get('registrations'),
+            'unregistrations': counters.get('unregistrations'),
+            'updates': counters.get('updates'),
+            'rejected': counters.get('rejected'),
+            'registrationsPerSecond': round(counters.get('registrations') / elapsed, 2),
+            'txnAttempts': counters.get('txnAttempts'),
+            'txnCommits': counters.get('txnCommits'),
+            'txnConflicts': conflicts,
+            'txnRetries': max(conflicts - counters.get('aborts'), 0),
+            'aborts': counters.get('aborts'),
+            'seatsConsistent': all(c['ok'] for c in conferences),
+            'perConference': conferences,
+        }))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+"""search_check.py
+
+Runs conference & session full-text search against the local search,
+datastore and taskqueue stubs. Creates -c conferences with -s sessions
+each through the API, renames one conference, then pages through the
+searchConferences/searchSessions results and checks the ranking, the
+paging and that the rename was indexed. Prints one JSON line with the
+matches and query latencies.
+
+    GAE_SDK=/path/to/google_appengine python benchmarks/search_check.py -c 200 -s 10
+
+"""
+
+import argparse
+import json
+import time
+
+import gae_env
+gae_env.setup()
+
+from google.appengine.api import users
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+import conference
+from conference import ConferenceApi
+from models import ConferenceForm
+from models import Profile
+from models import SessionForm
+from models import TeeShirtSize
+
+ORGANIZER = 'organizer@example.com'
+CITIES = ['London', 'Paris', 'Tokyo', 'Berlin']
+
+
+def api():
+    result = ConferenceApi()
+    result._currentUser = (users.User(ORGANIZER, _auth_domain='example.com'), ORGANIZER)
+    return result
+
+
+def seed(args):
+    Profile(id=ORGANIZER, displayName='Organizer', mainEmail=ORGANIZER,
+            teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED)).put()
+    keys = []
+    for i in range(args.conferences):
+        # every tenth conference is about search in its name, the rest
+        # only mention it in the description
+        name = 'Search Summit %d' % i if i % 10 == 0 else 'Conference %d' % i
+        api().createConference(ConferenceForm(
+            name=name, description='Talks on search and more', city=CITIES[i % len(CITIES)],
+            topics=['Cloud'], startDate='2017-06-01', maxAttendees=100))
+    for conf in api().getConferencesCreated(message_types.VoidMessage()).items:
+        keys.append(conf.websafeKey)
+        request = conference.SESSIONS_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=conf.websafeKey,
+            items=[SessionForm(name='Session %d' % j, highlights='Indexing deep dive',
+                               speaker='Ada Lovelace' if j == 0 else 'Speaker %d' % j,
+                               typeOfSession='lecture', duration='1h')
+                   for j in range(args.sessions)])
+        api().createSessions(request)
+    return sorted(keys)
+
+
+def pages(search, container, args, **fields):
+    """Page through a search; returns (forms, pages, ms per page)."""
+    forms, token, times = [], None, []
+    while True:
+        started = time.time()
+        result = search(container.combined_message_class(
+            pageSize=args.page_size, pageToken=token, **fields))
+        times.append((time.time() - started) * 1000)
+        forms.extend(result.items)
+        token = result.nextPageToken
+        if not token or not result.items:
+            return forms, len(times), times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-c', '--conferences', type=int, default=200)
+    parser.add_argument('-s', '--sessions', type=int, default=10, help='sessions per conference')
+    parser.add_argument('--page-size', type=int, default=20)
+    args = parser.parse_args()
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=gae_env.APP_ROOT)
+    tb.init_search_stub()
+    tb.init_app_identity_stub()
+    tb.init_user_stub()
+    try:
+        keys = seed(args)
+
+        confs, confPages, confMs = pages(api().searchConferences,
+                                         conference.SEARCH_REQUEST, args, query='search')
+        names = [c.name for c in confs]
+        titled = (args.conferences + 9) // 10
+        assert len(set(c.websafeKey for c in confs)) == args.conferences, \
+            'paging returned %d distinct of %d conferences' % (
+                len(set(c.websafeKey for c in confs)), args.conferences)
+        assert all(n.startswith('Search Summit') for n in names[:titled]), \
+            'name matches are not ranked first'
+
+        api().updateConference(conference.CONF_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=keys[0], name='Renamed Gathering'))
+        renamed, _, _ = pages(api().searchConferences, conference.SEARCH_REQUEST, args,
+                              query='gathering')
+        assert [c.websafeKey for c in renamed] == [keys[0]], 'update was not indexed'
+
+        sessions, sessionPages, sessionMs = pages(
+            api().searchSessions, conference.SESSION_SEARCH_REQUEST, args,
+            query='speaker:lovelace')
+        assert len(sessions) == args.conferences, \
+            'found %d of %d sessions by speaker' % (len(sessions), args.conferences)
+        within, _, _ = pages(api().searchSessions, conference.SESSION_SEARCH_REQUEST, args,
+                             query='indexing', websafeConferenceKey=keys[1])
+        assert len(within) == args.sessions and \
+            all(s.websafeConferenceKey == keys[1] for s in within), \
+            'conference filter returned %d sessions' % len(within)
+
+        print(json.dumps({
+            'conferences': args.conferences,
+            'sessions': args.conferences * args.sessions,
+            'conferenceMatches': len(confs),
+            'conferencePages': confPages,
+            'sessionMatches': len(sessions),
+            'sessionPages': sessionPages,
+            'meanPageMs': round(sum(confMs + sessionMs) / len(confMs + sessionMs), 2),
+            'maxPageMs': round(max(confMs + sessionMs), 2),
+        }))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,31 +11,44 @@ __author__ = 'bchen116@google.com (Ben Chen)'
 
 from datetime import datetime
 
+import operator
+import re
+import time
+
 import endpoints
 from protorpc import messages
+from protorpc import protobuf
 from protorpc import message_types
 from protorpc import remote
 
 from google.appengine.api import memcache
-from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
+from models import ProfileForms
+from models import Registration
 from models import StringMessage
 from models import BooleanMessage
 from models import Conference
+from models import ConferenceSpeaker
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import FacetsForm
+from models import FacetValueForm
 from models import TeeShirtSize
 from models import Session
+from models import MovedSession
+from models import NearlySoldOut
 from models import SessionForm
 from models import SessionForms
 from models import SessionQueryForms
+from models import Speaker
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -44,12 +57,41 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+import converters
+import facets
+import instrumentation
+import notifications
+import searchindex
+import seats
+import unitofwork
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURESPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_FEATURESPEAKER_KEY = "FEATURED_SPEAKER:%s"
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+NEARLY_SOLD_OUT_SEATS = 5
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE:%s"
+MEMCACHE_SPEAKER_KEY = "SPEAKER_SESSIONS:%s"
+CONFERENCE_CACHE_TTL = 600
+CONFERENCE_MISSING_TTL = 60
+CONFERENCE_LEASE_TTL = 5
+CONFERENCE_LEASE_RETRIES = 20
+SPEAKER_CACHE_TTL = 600
+SPEAKER_LEASE_TTL = 5
+# conference & speaker cache entries are tagged with their first character
+CACHED_FORM, CACHED_LEASE, CACHED_MISSING = 'F', 'L', 'M'
+FEATURED_SPEAKER_TPL = ('The featured speaker %s has the following '
+                        'Sessions: %s')
+# sessions added within one window share a single featured speaker refresh
+FEATURED_SPEAKER_WINDOW = 10
+FEATURED_SPEAKER_BATCH_SIZE = 100
+ORGANIZER_NAME_WINDOW = 10
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MIGRATION_BATCH_SIZE = 100
+FANOUT_BATCH_SIZE = 100
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -82,6 +124,46 @@ FIELDS =    {
             'MAX_ATTENDEES': 'maxAttendees',
             }
 
+CONFERENCE_MAPPER = converters.mapper(Conference, ConferenceForm)
+PROFILE_MAPPER = converters.mapper(Profile, ProfileForm)
+SESSION_MAPPER = converters.mapper(Session, SessionForm)
+
+SESSION_FIELDS = {
+            'CONFERENCE': 'websafeConferenceKey',
+            'NAME': 'name',
+            'SPEAKER': 'speaker',
+            'TYPE': 'typeOfSession',
+            'DURATION': 'duration',
+            'DATE': 'date',
+            'START_TIME': 'startTime',
+            }
+
+# equality filters the planner prefers to send to the datastore, most
+# selective first
+SESSION_EQUALITY_RANK = ['websafeConferenceKey', 'speaker', 'name', 'date',
+                         'typeOfSession', 'duration']
+
+# (equality, inequality) property pairs with a composite index in index.yaml
+SESSION_INDEXED_PAIRS = set([('date', 'startTime'), ('typeOfSession', 'startTime')])
+
+# in-memory versions of OPERATORS for predicates the datastore doesn't get
+PREDICATES = {
+            '=':  operator.eq,
+            '>':  operator.gt,
+            '>=': operator.ge,
+            '<':  operator.lt,
+            '<=': operator.le,
+            '!=': operator.ne,
+            }
+
+# day-part buckets by session start time: (bucket, starts before)
+DAY_PARTS = [('morning', datetime.strptime('12:00', '%H:%M').time()),
+             ('afternoon', datetime.strptime('19:00', '%H:%M').time()),
+             ('evening', None)]
+
+# most entities one querySessions page may scan before returning early
+MAX_SESSION_SCAN = 1000
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -113,11 +195,51 @@ SESSION_Date_GET_REQUEST  = endpoints.ResourceContainer(
     date = messages.StringField(1),
 )
 
+SESSION_DATE_PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    date = messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
 SESSION_POST_REQUEST = endpoints.ResourceContainer(
     SessionForm,
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(2),
+)
+
+PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(2),
+)
+
+CONF_PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    pageSize=messages.IntegerField(2, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(3),
+)
+
+SESSION_SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    websafeConferenceKey=messages.StringField(2),
+    pageSize=messages.IntegerField(3, variant=messages.Variant.INT32),
+    pageToken=messages.StringField(4),
+)
+
 WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     SessionKey=messages.StringField(1),
@@ -134,31 +256,16 @@ class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
-    def _copyConferenceToForm(self, conf, displayName):
+    def _copyConferenceToForm(self, conf, seatsAvailable=None):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
-        return cf
-
-    def _createConferenceObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-        # preload necessary data items
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        # seats live in shards; prefer the summed count when we have it
+        if seatsAvailable is not None:
+            return CONFERENCE_MAPPER.copy(conf, seatsAvailable=seatsAvailable)
+        return CONFERENCE_MAPPER.copy(conf)
 
+    @staticmethod
+    def _conferenceFromForm(request, user_id, c_key):
+        """Build an unsaved Conference with key c_key from a ConferenceForm."""
         if not request.name:
             raise endpoints.BadRequestException("Conference 'name' field required")
 
@@ -185,30 +292,50 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
+        data['key'] = c_key
+        data['organizerUserId'] = request.organizerUserId = user_id
+        data['seatShards'] = seats.NUM_SHARDS
+        return Conference(**data)
+
+    def _createConferenceObject(self, request):
+        """Create or update Conference object, returning ConferenceForm/request."""
+        # preload necessary data items
+        user, user_id = self._getCurrentUser()
+
         # generate Profile Key based on user ID and Conference
         # ID based on Profile key get Conference key from ID
         p_key = ndb.Key(Profile, user_id)
         c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
         c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                              'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email'
-        )
+        conf = self._conferenceFromForm(request, user_id, c_key)
+        # store the organizer's name with the conference so listings
+        # don't have to read the Profile
+        prof = p_key.get()
+        conf.organizerDisplayName = request.organizerDisplayName = (
+            prof.displayName if prof else user.nickname())
+
+        # create Conference along with its seat shards, send email to
+        # organizer confirming creation of Conference & return (modified)
+        # ConferenceForm
+        self._storeNewConference(conf, user.email(), repr(request))
+        searchindex.index_conferences([conf])
+        self._updateNearlySoldOut(c_key.urlsafe(), conf.name, conf.seatsAvailable)
         return request
 
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _storeNewConference(conf, email, conferenceInfo):
+        """Put a new Conference & its shards; the confirmation is queued
+        for the digest mailer in the same transaction so it can't be lost."""
+        ndb.put_multi([conf] + seats.new_shards(conf.key, conf.seatsAvailable))
+        unitofwork.enqueue(notifications.confirmation_task(email, conferenceInfo),
+                           queue_name=notifications.CONFIRMATION_QUEUE)
+        unitofwork.enqueue(facets.count_task([conf.key.urlsafe()]))
+
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user, user_id = self._getCurrentUser()
 
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
@@ -227,8 +354,14 @@ class ConferenceApi(remote.Service):
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
+        oldMaxAttendees = conf.maxAttendees or 0
+        oldFacets = facets.facet_ids(conf)
         for field in request.all_fields():
             data = getattr(request, field.name)
+            # seatsAvailable is derived from the seat shards and
+            # organizerDisplayName follows the organizer's Profile
+            if field.name in ('seatsAvailable', 'organizerDisplayName'):
+                continue
             # only copy fields where we get data
             if data not in (None, []):
                 # special handling for dates (convert string to Date)
@@ -238,11 +371,20 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
+
+        # hand seats added or removed by a maxAttendees change to the shards
+        delta = (conf.maxAttendees or 0) - oldMaxAttendees
+        if delta and conf.seatShards:
+            conf.seatsAvailable = seats.adjust_shards(conf, delta)
+        elif delta:
+            conf.seatsAvailable = max((conf.seatsAvailable or 0) + delta, 0)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        # recount the city/topic/month counters if this one moved
+        if facets.facet_ids(conf) != oldFacets:
+            unitofwork.enqueue(facets.count_task([conf.key.urlsafe()]))
+        return self._copyConferenceToForm(conf)
 
-    @endpoints.method(ConferenceForm,
+    @instrumentation.method(ConferenceForm,
                       ConferenceForm,
                       path='conference',
                       http_method='POST',
@@ -251,32 +393,85 @@ class ConferenceApi(remote.Service):
         """Create new conference."""
         return self._createConferenceObject(request)
 
-    @endpoints.method(CONF_POST_REQUEST,
+    @instrumentation.method(CONF_POST_REQUEST,
                       ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='PUT',
                       name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        cf = self._updateConferenceObject(request)
+        self._invalidateConferences([cf.websafeKey])
+        searchindex.index_conferences([ndb.Key(urlsafe=cf.websafeKey).get()])
+        self._updateNearlySoldOut(cf.websafeKey, cf.name, cf.seatsAvailable)
+        return cf
+
+    @staticmethod
+    def _invalidateConferences(websafeConferenceKeys):
+        """Drop cached ConferenceForms (and any rebuild lease on them)."""
+        memcache.delete_multi([MEMCACHE_CONFERENCE_KEY % ndb.Key(urlsafe=wsck).urlsafe()
+                               for wsck in websafeConferenceKeys])
+
+    def _loadConferenceForm(self, c_key):
+        """Return the ConferenceForm for c_key from the datastore, or None."""
+        conf = c_key.get()
+        if not conf:
+            return None
+        return self._copyConferenceToForm(conf, seats.count_seats(conf))
+
+    def _getConferenceForm(self, c_key):
+        """Return the ConferenceForm for c_key, or None if there's no such
+        conference, reading through memcache.
 
-    @endpoints.method(CONF_GET_REQUEST,
+        Only the request holding the lease (an add() of CACHED_LEASE) goes
+        to the datastore when the entry is missing; the others poll the
+        entry until it is filled in. The rebuilt form is stored with cas()
+        so an invalidation that lands during the rebuild wins.
+        """
+        client = memcache.Client()
+        key = MEMCACHE_CONFERENCE_KEY % c_key.urlsafe()
+        for attempt in range(CONFERENCE_LEASE_RETRIES):
+            cached = client.get(key)
+            if cached is None:
+                if client.add(key, CACHED_LEASE, time=CONFERENCE_LEASE_TTL):
+                    break
+            elif cached[0] == CACHED_FORM:
+                return protobuf.decode_message(ConferenceForm, cached[1:])
+            elif cached[0] == CACHED_MISSING:
+                return None
+            else:
+                # somebody else is rebuilding this entry
+                time.sleep(0.05)
+        else:
+            # the lease holder is too slow; don't pile up behind it
+            return self._loadConferenceForm(c_key)
+
+        # we hold the lease; gets() fetches the cas id to replace it with
+        client.gets(key)
+        cf = self._loadConferenceForm(c_key)
+        if cf:
+            client.cas(key, CACHED_FORM + protobuf.encode_message(cf),
+                       time=CONFERENCE_CACHE_TTL)
+        else:
+            client.cas(key, CACHED_MISSING, time=CONFERENCE_MISSING_TTL)
+        return cf
+
+    @instrumentation.method(CONF_GET_REQUEST,
                       ConferenceForm,
                       path='conference/{websafeConferenceKey}',
                       http_method='GET',
                       name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
+        # get ConferenceForm from cache or datastore; bail if not found
+        cf = self._getConferenceForm(ndb.Key(urlsafe=request.websafeConferenceKey))
+        if not cf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return cf
 
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(message_types.VoidMessage,
                       ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST',
@@ -284,17 +479,14 @@ class ConferenceApi(remote.Service):
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user, user_id = self._getCurrentUser()
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch()
+        available = seats.cached_seats(confs)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf, available[conf.key]) for conf in confs]
         )
 
 
@@ -317,6 +509,20 @@ class ConferenceApi(remote.Service):
             q = q.filter(formatted_query)
         return q
 
+    def _pageSize(self, request):
+        """Return the pageSize field clamped so a single call stays bounded."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        return max(1, min(page_size, MAX_PAGE_SIZE))
+
+    def _pageArgs(self, request):
+        """Return (page size, start Cursor) from pageSize/pageToken fields."""
+        page_size = self._pageSize(request)
+        try:
+            start_cursor = Cursor(urlsafe=request.pageToken) if request.pageToken else None
+        except Exception:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        return page_size, start_cursor
+
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
@@ -344,121 +550,300 @@ class ConferenceApi(remote.Service):
             formatted_filters.append(filtr)
         return (inequality_field, formatted_filters)
 
-    @endpoints.method(ConferenceQueryForms,
+    @instrumentation.method(ConferenceQueryForms,
                       ConferenceForms,
                       path='queryConferences',
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
+        """Query for conferences, one page at a time."""
+        q = self._getQuery(request)
+        page_size, start_cursor = self._pageArgs(request)
 
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        # fetch the page exactly once; the cursor picks up where it left off
+        conferences, next_cursor, more = q.fetch_page(page_size, start_cursor=start_cursor)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        available = seats.cached_seats(conferences)
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=[self._copyConferenceToForm(conf, available[conf.key]) for conf in \
+                conferences],
+                nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+    @instrumentation.method(message_types.VoidMessage,
+                      FacetsForm,
+                      path='conferenceFacets',
+                      http_method='GET',
+                      name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return the cities, topics & start months conferences can be
+        filtered on, with the number of conferences having each."""
+        counts = facets.get_facets()
+        return FacetsForm(**dict(
+            (field, [FacetValueForm(value=value, count=count)
+                     for value, count in counts.get(facet, [])])
+            for field, facet in (('cities', 'city'), ('topics', 'topic'), ('months', 'month'))))
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - -
+    def _search(self, index_name, query_string, request):
+        """Return (entities of one page of search results, next pageToken)."""
+        if not request.query:
+            raise endpoints.BadRequestException("'query' field required")
+        try:
+            keys, next_token = searchindex.search_keys(
+                index_name, query_string, self._pageSize(request), request.pageToken)
+        except ValueError as e:
+            raise endpoints.BadRequestException('Invalid search: %s' % e)
+        # a document may outlive its entity until the reindex task runs
+        return [ent for ent in ndb.get_multi(keys) if ent], next_token
+
+    @instrumentation.method(SEARCH_REQUEST,
+                      ConferenceForms,
+                      path='searchConferences',
+                      http_method='GET',
+                      name='searchConferences')
+    def searchConferences(self, request):
+        """Full-text search over conference name, description, topics &
+        city, best matches first, one page at a time."""
+        confs, next_token = self._search(searchindex.CONFERENCE_INDEX,
+                                         request.query, request)
+        available = seats.cached_seats(confs)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, available[conf.key]) for conf in confs],
+            nextPageToken=next_token
+        )
+
+    @instrumentation.method(SESSION_SEARCH_REQUEST,
+                      SessionForms,
+                      path='searchSessions',
+                      http_method='GET',
+                      name='searchSessions')
+    def searchSessions(self, request):
+        """Full-text search over session name, highlights & speaker, best
+        matches first, optionally within one conference (by
+        websafeConferenceKey)."""
+        query_string = request.query
+        if request.query and request.websafeConferenceKey:
+            query_string = '(%s) websafeConferenceKey:%s' % (
+                request.query, searchindex.quote(request.websafeConferenceKey))
+        sessions, next_token = self._search(searchindex.SESSION_INDEX,
+                                            query_string, request)
+        return SessionForms(
+            items=SESSION_MAPPER.copy_all(sessions),
+            nextPageToken=next_token
         )
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_MAPPER.copy(prof)
+
+    # endpoints makes a new service instance per request, so these memoize
+    # the caller's identity & Profile for one request
+    _currentUser = None
+    _profile = None
+    _profileIsNew = False
+
+    def _getCurrentUser(self):
+        """Return (user, user id) of the caller, checking auth once per request."""
+        if self._currentUser is None:
+            # make sure user is authed
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException('Authorization required')
+            self._currentUser = (user, getUserId(user))
+        return self._currentUser
+
+    def _newProfile(self):
+        """Return an unsaved Profile for the current user."""
+        user, user_id = self._getCurrentUser()
+        return Profile(
+            key = ndb.Key(Profile, user_id),
+            displayName = user.nickname(),
+            mainEmail= user.email(),
+            teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
+        )
 
     def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
-        # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        """Return user Profile, from this request or the datastore (ndb
+        keeps it in memcache). A user without a Profile gets a new one that
+        isn't written until _updateProfile.
+        """
+        if self._profile is None:
+            user, user_id = self._getCurrentUser()
+            profile = unitofwork.get(ndb.Key(Profile, user_id))
+            # create new Profile if not there
+            self._profileIsNew = profile is None
+            self._profile = profile or self._newProfile()
+        return self._profile      # return Profile
 
-        # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
-        # create new Profile if not there
-        if not profile:
-            profile = Profile(
-                key = p_key,
-                displayName = user.nickname(),
-                mainEmail= user.email(),
-                teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
-            )
-            profile.put()
-
-        return profile      # return Profile
+    @ndb.transactional()
+    def _updateProfile(self, change=None):
+        """Read the user's Profile in a transaction (a new one if there's
+        none), apply change(prof) & write it back; returns what change
+        returned. Profile changes go through here so concurrent ones
+        can't overwrite each other.
+        """
+        user, user_id = self._getCurrentUser()
+        prof = ndb.Key(Profile, user_id).get() or self._newProfile()
+        result = change(prof) if change else None
+        prof.put()
+        self._profile, self._profileIsNew = prof, False
+        return result
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
-        # get user Profile
-        prof = self._getProfileFromUser()
-
         # if saveProfile(), process user-modifyable fields
         if save_request:
-            for field in ('displayName', 'teeShirtSize'):
-                if hasattr(save_request, field):
-                    val = getattr(save_request, field)
-                    if val:
-                        setattr(prof, field, str(val))
-                        prof.put()
+            def change(prof):
+                oldDisplayName = prof.displayName
+                for field in ('displayName', 'teeShirtSize'):
+                    if hasattr(save_request, field):
+                        val = getattr(save_request, field)
+                        if val:
+                            setattr(prof, field, str(val))
+                return oldDisplayName
+            oldDisplayName = self._updateProfile(change)
+            prof = self._profile
+            # conferences carry a copy of the organizer's name
+            if prof.displayName != oldDisplayName:
+                unitofwork.enqueue(self._organizerNameTask(prof.key.id()))
+            unitofwork.flush()
+        else:
+            # get user Profile
+            prof = self._getProfileFromUser()
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(message_types.VoidMessage,
                       ProfileForm,
                       path='profile',
                       http_method='GET',
                       name='getProfile')
+    @unitofwork.endpoint
     def getProfile(self, request):
         """Return user profile."""
         return self._doProfile()
 
-    @endpoints.method(ProfileMiniForm,
+    @instrumentation.method(ProfileMiniForm,
                       ProfileForm,
                       path='profile',
                       http_method='POST',
                       name='saveProfile')
+    @unitofwork.endpoint
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _organizerNameTask(organizerUserId):
+        """Return the update_organizer_name task of an organizer for the
+        current window; it runs once the window closes & reads the name
+        then, so every rename during the window shares it.
+        """
+        now = time.time()
+        window = int(now / ORGANIZER_NAME_WINDOW)
+        return unitofwork.task('/tasks/update_organizer_name',
+                               params={'organizerUserId': organizerUserId},
+                               name='organizer-name-%s-%d' % (organizerUserId, window),
+                               countdown=(window + 1) * ORGANIZER_NAME_WINDOW - now)
+
+    @staticmethod
+    def _updateOrganizerNames(organizerUserId=None, websafeCursor=None):
+        """Copy organizer display names onto one batch of Conferences;
+        returns the cursor of the next batch or None when done. With no
+        organizerUserId every Conference is visited (backfill).
+        """
+        if organizerUserId:
+            q = Conference.query(ancestor=ndb.Key(Profile, organizerUserId))
+        else:
+            q = Conference.query()
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        confs, next_cursor, more = q.order(Conference.key).fetch_page(
+            FANOUT_BATCH_SIZE, start_cursor=cursor)
+
+        # read each organizer's current name once per batch
+        organizers = list(set(conf.key.parent() for conf in confs))
+        names = dict((p.key, p.displayName)
+                     for p in ndb.get_multi(organizers) if p)
+
+        changed = []
+        for conf in confs:
+            name = names.get(conf.key.parent())
+            if name and conf.organizerDisplayName != name:
+                conf.organizerDisplayName = name
+                changed.append(conf)
+        ndb.put_multi(changed)
+        ConferenceApi._invalidateConferences([conf.key.urlsafe() for conf in changed])
+
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _syncSeatsAvailable(websafeConferenceKey):
+        """Copy the summed seat shards onto Conference.seatsAvailable;
+        used by the sync_seats task so seat range queries stay current.
+        """
+        conf = seats.sync_seats(ndb.Key(urlsafe=websafeConferenceKey))
+        if conf:
+            ConferenceApi._updateNearlySoldOut(
+                websafeConferenceKey, conf.name, conf.seatsAvailable)
+        return conf
+
+    @staticmethod
+    def _nearlySoldOutKey():
+        return ndb.Key(NearlySoldOut, MEMCACHE_ANNOUNCEMENTS_KEY)
+
+    @staticmethod
+    @ndb.transactional()
+    def _setNearlySoldOut(websafeConferenceKey, name, nearlySoldOut):
+        """Add or remove one conference from the NearlySoldOut set;
+        returns True if the set changed.
+        """
+        key = ConferenceApi._nearlySoldOutKey()
+        entry = key.get() or NearlySoldOut(key=key)
+        if websafeConferenceKey in entry.conferenceKeys:
+            i = entry.conferenceKeys.index(websafeConferenceKey)
+            if nearlySoldOut and entry.conferenceNames[i] == name:
+                return False
+            del entry.conferenceKeys[i]
+            del entry.conferenceNames[i]
+        elif not nearlySoldOut:
+            return False
+        if nearlySoldOut:
+            entry.conferenceKeys.append(websafeConferenceKey)
+            entry.conferenceNames.append(name)
+        entry.put()
+        return True
+
+    @staticmethod
+    def _updateNearlySoldOut(websafeConferenceKey, name, seatsAvailable):
+        """Track a conference's seatsAvailable crossing the nearly sold out
+        range & refresh the announcement if that changed the set.
+        """
+        nearlySoldOut = 0 < (seatsAvailable or 0) <= NEARLY_SOLD_OUT_SEATS
+        if ConferenceApi._setNearlySoldOut(websafeConferenceKey, name, nearlySoldOut):
+            ConferenceApi._cacheAnnouncement()
+
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Create Announcement from the NearlySoldOut set & assign to
+        memcache; used whenever that set changes & by the cron check.
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
+        entry = ConferenceApi._nearlySoldOutKey().get()
 
-        if confs:
+        if entry and entry.conferenceNames:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
             announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
+                ', '.join(entry.conferenceNames))
             memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
         else:
             # If there are no sold out conferences,
@@ -468,7 +853,30 @@ class ConferenceApi(remote.Service):
 
         return announcement
 
-    @endpoints.method(message_types.VoidMessage,
+    @staticmethod
+    def _checkAnnouncement():
+        """Reconcile the NearlySoldOut set with a keys-only seat query &
+        re-cache the announcement; used by memcache cron job.
+        """
+        keys = Conference.query(ndb.AND(
+            Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+            Conference.seatsAvailable > 0)
+        ).fetch(keys_only=True)
+        expected = set(key.urlsafe() for key in keys)
+
+        entry = ConferenceApi._nearlySoldOutKey().get()
+        current = set(entry.conferenceKeys) if entry else set()
+
+        # only conferences the events missed cost a read
+        for wsck in current - expected:
+            ConferenceApi._setNearlySoldOut(wsck, None, False)
+        missing = [ndb.Key(urlsafe=wsck) for wsck in expected - current]
+        for conf in ndb.get_multi(missing):
+            if conf:
+                ConferenceApi._setNearlySoldOut(conf.key.urlsafe(), conf.name, True)
+        return ConferenceApi._cacheAnnouncement()
+
+    @instrumentation.method(message_types.VoidMessage,
                       StringMessage,
                       path='conference/announcement/get',
                       http_method='GET',
@@ -479,11 +887,83 @@ class ConferenceApi(remote.Service):
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _registrationKey(p_key, wsck):
+        """Return the key of a Profile's Registration for a Conference."""
+        return ndb.Key(Registration, wsck, parent=p_key)
+
+    @ndb.transactional(xg=True)
+    def _takeSeat(self, p_key, conf_key, shard_key):
+        """Register user on one seat shard; None if the shard ran dry."""
+        r_key = self._registrationKey(p_key, conf_key.urlsafe())
+        registration, shard = ndb.get_multi([r_key, shard_key])
+
+        # check if user already registered otherwise add
+        if registration:
+            raise ConflictException(
+                "You have already registered for this conference")
+
+        # another request may have emptied this shard since we picked it
+        if not shard or shard.seats <= 0:
+            return None
+
+        # register user, take away one seat
+        shard.seats -= 1
+        ndb.put_multi([Registration(key=r_key, conferenceKey=conf_key), shard])
+        return True
+
     @ndb.transactional(xg=True)
+    def _releaseSeat(self, p_key, conf_key, shard_key):
+        """Unregister user, giving the seat back to one shard."""
+        r_key = self._registrationKey(p_key, conf_key.urlsafe())
+        registration, shard = ndb.get_multi([r_key, shard_key])
+
+        # check if user already registered
+        if not registration:
+            return False
+
+        # unregister user, add back one seat
+        shard.seats += 1
+        r_key.delete()
+        shard.put()
+        return True
+
+    @staticmethod
+    @ndb.transactional()
+    def _moveRegistrations(p_key):
+        """Turn a Profile's conferenceKeysToAttend list into Registrations."""
+        prof = p_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return prof
+        registrations = [Registration(key=ConferenceApi._registrationKey(p_key, wsck),
+                                      conferenceKey=ndb.Key(urlsafe=wsck))
+                         for wsck in set(prof.conferenceKeysToAttend)]
+        prof.conferenceKeysToAttend = []
+        ndb.put_multi([prof] + registrations)
+        return prof
+
+    @staticmethod
+    def _migrateRegistrations(websafeCursor=None):
+        """Move one batch of Profiles to Registration entities; returns the
+        cursor of the next batch or None when done.
+        """
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        profiles, next_cursor, more = Profile.query().order(Profile.key).fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor)
+        for prof in profiles:
+            if prof.conferenceKeysToAttend:
+                ConferenceApi._moveRegistrations(prof.key)
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
         prof = self._getProfileFromUser() # get user Profile
+        # registrations still held on the profile move over first
+        if prof.conferenceKeysToAttend:
+            prof = self._profile = self._moveRegistrations(prof.key)
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
@@ -495,83 +975,116 @@ class ConferenceApi(remote.Service):
 
         # register
         if reg:
-            # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
-                raise ConflictException(
-                    "You have already registered for this conference")
+            # try the shards that still had seats until one of them commits;
+            # each attempt only locks the user's registration and that one shard
+            for shard_key in seats.candidate_shards(conf):
+                retval = self._takeSeat(prof.key, conf.key, shard_key)
+                if retval:
+                    break
 
             # check if seats avail
-            if conf.seatsAvailable <= 0:
+            if not retval:
                 raise ConflictException(
                     "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            seats.seat_taken(conf.key)
+            self._invalidateConferences([wsck])
+            # attendee lists read the Profile, so a new one is written now
+            if self._profileIsNew:
+                self._updateProfile()
 
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
-
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+            retval = self._releaseSeat(prof.key, conf.key, seats.random_shard(conf))
+            if retval:
+                seats.seat_released(conf.key)
+                self._invalidateConferences([wsck])
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(PAGE_GET_REQUEST,
                       ConferenceForms,
                       path='conferences/attending',
                       http_method='GET',
                       name='getConferencesToAttend')
+    @unitofwork.endpoint
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        if prof.conferenceKeysToAttend:
+            prof = self._profile = self._moveRegistrations(prof.key)
+        page_size, start_cursor = self._pageArgs(request)
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # registrations are children of the profile; the key id is the conference
+        r_keys, next_cursor, more = Registration.query(ancestor=prof.key).fetch_page(
+            page_size, start_cursor=start_cursor, keys_only=True)
+        conf_keys = [ndb.Key(urlsafe=r_key.id()) for r_key in r_keys]
+        conferences = [conf for conf in ndb.get_multi(conf_keys) if conf]
+        available = seats.cached_seats(conferences)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        return ConferenceForms(items=[self._copyConferenceToForm(conf, available[conf.key])\
+         for conf in conferences],
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
         )
 
+    @instrumentation.method(CONF_GET_REQUEST,
+                      BooleanMessage,
+                      path='conference/{websafeConferenceKey}/registered',
+                      http_method='GET',
+                      name='isRegisteredForConference')
+    @unitofwork.endpoint
+    def isRegisteredForConference(self, request):
+        """Return whether the user is registered for a conference."""
+        prof = self._getProfileFromUser() # get user Profile
+        wsck = request.websafeConferenceKey
+        if wsck in prof.conferenceKeysToAttend:
+            return BooleanMessage(data=True)
+        conf_key = ndb.Key(urlsafe=wsck)
+        registration = self._registrationKey(prof.key, conf_key.urlsafe()).get()
+        return BooleanMessage(data=registration is not None)
+
+    @instrumentation.method(CONF_PAGE_GET_REQUEST,
+                      ProfileForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET',
+                      name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return the profiles registered for a conference; organizer only."""
+        conf, user_id = self._getOwnedConference(
+            request.websafeConferenceKey,
+            'Only the owner of the conference can list its attendees.')
+        page_size, start_cursor = self._pageArgs(request)
+
+        q = Registration.query(Registration.conferenceKey == conf.key)
+        r_keys, next_cursor, more = q.fetch_page(
+            page_size, start_cursor=start_cursor, keys_only=True)
+        profiles = [p for p in ndb.get_multi([k.parent() for k in r_keys]) if p]
+        return ProfileForms(
+            items=PROFILE_MAPPER.copy_all(profiles),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
 
-    @endpoints.method(CONF_GET_REQUEST,
+    @instrumentation.method(CONF_GET_REQUEST,
                       BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='POST',
                       name='registerForConference')
+    @unitofwork.endpoint
     def registerForConference(self, request):
         """Register user for selected conference."""
         return self._conferenceRegistration(request)
 
-    @endpoints.method(CONF_GET_REQUEST,
+    @instrumentation.method(CONF_GET_REQUEST,
                       BooleanMessage,
                       path='conference/{websafeConferenceKey}',
                       http_method='DELETE',
                       name='unregisterFromConference')
+    @unitofwork.endpoint
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
         return self._conferenceRegistration(request, reg=False)
 
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(message_types.VoidMessage,
                       ConferenceForms,
                       path='filterPlayground',
                       http_method='GET',
@@ -584,7 +1097,7 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month==6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=CONFERENCE_MAPPER.copy_all(q)
         )
 
 # ----------------------------------------------------------------------------------
@@ -592,124 +1105,240 @@ class ConferenceApi(remote.Service):
 # ----------------------------------------------------------------------------------
 
     def _copySessionToForm(self, session):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        cs = SessionForm()
-        for field in cs.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('date'):
-                    setattr(cs, field.name, str(getattr(session, field.name)))
-                elif field.name.endswith('Time'):
-                    setattr(cs, field.name, str(getattr(session, field.name)))
-                else:
-                    setattr(cs, field.name, getattr(session, field.name))
-            elif field.name == "websafeKey":
-                setattr(cs, field.name, session.key.urlsafe())
-        cs.check_initialized()
-        return cs
-
-    def _createSessionObject(self, request):
-        """Create or update Conference object, returning ConferenceForm/request."""
-
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        """Copy relevant fields from Session to SessionForm."""
+        return SESSION_MAPPER.copy(session)
+
+    def _getOwnedConference(self, websafeConferenceKey,
+                            message='Only the owner of the conference can create session.'):
+        """Return (Conference, user_id), checking the user organizes it;
+        message is the error for anyone else."""
+        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
+                'No conference found with key: %s' % websafeConferenceKey)
 
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-        user_id = getUserId(user)
+        user, user_id = self._getCurrentUser()
 
         if user_id != conf.organizerUserId:
-            raise endpoints.ForbiddenException(
-                'Only the owner of the conference can create session.')
+            raise endpoints.ForbiddenException(message)
+        return conf, user_id
 
-        if not request.name:
+    @staticmethod
+    def _sessionFromForm(form, conf, user_id, s_key):
+        """Build an unsaved Session with key s_key from a SessionForm."""
+        if not form.name:
             raise endpoints.BadRequestException("Session 'name' field required")
-        #
-        # # copy ConferenceForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeConferenceKey']
-        # #del data['organizerDisplayName']
-        #
-        # # add default values for those missing (both data model & outbound Message)
+
+        # copy SessionForm/ProtoRPC Message into dict
+        data = {field.name: getattr(form, field.name) for field in SessionForm.all_fields()}
+
+        # add default values for those missing (both data model & outbound Message)
         for df in SESSION_EFAULTS:
             if data[df] in (None, []):
                 data[df] = SESSION_EFAULTS[df]
-                setattr(request, df, SESSION_EFAULTS[df])
+                setattr(form, df, SESSION_EFAULTS[df])
 
         data['organizerUserId']= user_id
-        data['websafeConferenceKey'] = request.websafeConferenceKey
+        data['websafeConferenceKey'] = conf.key.urlsafe()
         data['conferenceName']=conf.name
-
-        p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
-        s_key = ndb.Key(Session, s_id, parent=c_key)
         data['key'] = s_key
 
         if data['date']:
             data['startTime'] = datetime.strptime(data['date'], '%Y-%m-%d %H:%M:%S').time()
             data['date'] = datetime.strptime(data['date'][:10], "%Y-%m-%d").date()
-
-        # # create Conference, send email to organizer confirming
-        # # creation of Conference & return (modified) ConferenceForm
         session = Session(**data)
-        session.put()
+        ConferenceApi._classifySession(session)
+        session.speakerKey = ConferenceApi._speakerKey(session.speaker)
+        # picked up by the next featured speaker refresh of the conference
+        session.speakerPending = True
+        return session
+
+    @staticmethod
+    def _speakerKey(speaker):
+        """Return the Speaker key for a name, folding case, punctuation and
+        whitespace so spelling variants share one Speaker."""
+        normalized = ' '.join(re.sub(r'[^\w\s]', ' ', speaker or '', flags=re.UNICODE)
+                              .lower().split())
+        return ndb.Key(Speaker, normalized or '?')
+
+    @staticmethod
+    @ndb.transactional()
+    def _addSpeakerSessions(speakerKey, name, sessionKeys, oldKeys):
+        speaker = speakerKey.get() or Speaker(key=speakerKey, name=name)
+        keys = [k for k in speaker.sessionKeys if k not in oldKeys]
+        keys.extend(k for k in sessionKeys if k not in keys)
+        if keys != speaker.sessionKeys:
+            speaker.sessionKeys = keys
+            speaker.put()
+
+    @staticmethod
+    def _indexSessionSpeakers(sessions, replaced=None):
+        """Add new Sessions to their Speakers' session lists, one
+        transaction per speaker, & drop the speakers' cached results.
+        replaced maps a new session key to the key it replaces.
+        """
+        replaced = replaced or {}
+        bySpeaker = {}
+        for session in sessions:
+            bySpeaker.setdefault(session.speakerKey, []).append(session)
+        for speakerKey, group in bySpeaker.items():
+            ConferenceApi._addSpeakerSessions(
+                speakerKey, group[0].speaker,
+                [s.key for s in group],
+                set(replaced[s.key] for s in group if s.key in replaced))
+        memcache.delete_multi([MEMCACHE_SPEAKER_KEY % k.id() for k in bySpeaker])
 
-        taskqueue.add(params={'websafeConferenceKey': request.websafeConferenceKey,
-                              'speaker': data['speaker']},
-                       url='/tasks/set_featured_speaker'
-                      )
+    @staticmethod
+    def _classifySession(session):
+        """Set the derived isWorkshop/dayPart/isEvening fields of a Session
+        so time-of-day queries are plain equality scans; returns True if
+        anything changed.
+        """
+        isWorkshop = (session.typeOfSession or '').strip().lower() == 'workshop'
+        dayPart = None
+        if session.startTime:
+            for dayPart, before in DAY_PARTS:
+                if before is None or session.startTime < before:
+                    break
+        isEvening = dayPart == 'evening' if dayPart else None
+        changed = (session.isWorkshop, session.dayPart, session.isEvening) != \
+            (isWorkshop, dayPart, isEvening)
+        session.isWorkshop, session.dayPart, session.isEvening = isWorkshop, dayPart, isEvening
+        return changed
+
+    def _sessionPage(self, q, request):
+        """Return one page of a session query as SessionForms."""
+        page_size, start_cursor = self._pageArgs(request)
+        sessions, next_cursor, more = q.fetch_page(page_size, start_cursor=start_cursor)
+        return SessionForms(
+            items=SESSION_MAPPER.copy_all(sessions),
+            nextPageToken=next_cursor.urlsafe() if more and next_cursor else None
+        )
+
+    @staticmethod
+    def _featuredSpeakerTask(websafeConferenceKey):
+        """Return the set_featured_speaker task of a conference for the
+        current window; it runs once the window closes and every session
+        added during the window shares it.
+        """
+        now = time.time()
+        window = int(now / FEATURED_SPEAKER_WINDOW)
+        return unitofwork.task('/tasks/set_featured_speaker',
+                               params={'websafeConferenceKey': websafeConferenceKey},
+                               name='featured-speaker-%s-%d' % (websafeConferenceKey, window),
+                               countdown=(window + 1) * FEATURED_SPEAKER_WINDOW - now)
+
+    def _createSessionObject(self, request):
+        """Create Session object, returning SessionForm."""
+        conf, user_id = self._getOwnedConference(request.websafeConferenceKey)
+
+        # Session is a child of its Conference so the conference's
+        # sessions can be listed with an ancestor query
+        s_id = Session.allocate_ids(size=1, parent=conf.key)[0]
+        s_key = ndb.Key(Session, s_id, parent=conf.key)
+
+        session = self._sessionFromForm(request, conf, user_id, s_key)
+        session.put()
+        self._indexSessionSpeakers([session])
+        searchindex.index_sessions([session])
+        unitofwork.enqueue(self._featuredSpeakerTask(request.websafeConferenceKey))
+        unitofwork.flush()
 
         return self._copySessionToForm(session)
 
-    @endpoints.method(SESSION_POST_REQUEST,
+    def _createSessionObjects(self, request):
+        """Create many Session objects at once, returning SessionForms."""
+        conf, user_id = self._getOwnedConference(request.websafeConferenceKey)
+        if not request.items:
+            return SessionForms(items=[])
+
+        # one id range for the whole batch
+        first, last = Session.allocate_ids(size=len(request.items), parent=conf.key)
+        sessions = [self._sessionFromForm(form, conf, user_id,
+                                          ndb.Key(Session, s_id, parent=conf.key))
+                    for form, s_id in zip(request.items, range(first, last + 1))]
+        ndb.put_multi(sessions)
+        self._indexSessionSpeakers(sessions)
+        searchindex.index_sessions(sessions)
+
+        # start adding the task while the response is built
+        unitofwork.enqueue(self._featuredSpeakerTask(request.websafeConferenceKey))
+        unitofwork.flush()
+
+        return SessionForms(
+            items=SESSION_MAPPER.copy_all(sessions)
+        )
+
+    @instrumentation.method(SESSION_POST_REQUEST,
                       SessionForm,
                       path='session',
                       http_method='POST',
                       name='createSession')
+    @unitofwork.endpoint
     def createSession(self, request):
         """Create new Session.(by websafeConferenceKey)"""
         if not request.websafeConferenceKey:
             raise endpoints.BadRequestException("Session 'websafeConferenceKey' field required")
-
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
         return self._createSessionObject(request)
 
-    @endpoints.method(SESSION_TYPE_GET_REQUEST,
+    @instrumentation.method(SESSIONS_POST_REQUEST,
+                      SessionForms,
+                      path='sessions',
+                      http_method='POST',
+                      name='createSessions')
+    @unitofwork.endpoint
+    def createSessions(self, request):
+        """Create many new Sessions in one call.(by websafeConferenceKey)"""
+        if not request.websafeConferenceKey:
+            raise endpoints.BadRequestException("Session 'websafeConferenceKey' field required")
+        return self._createSessionObjects(request)
+
+    @instrumentation.method(SESSION_TYPE_GET_REQUEST,
                       SessionForms,
                       path='getConferenceSessionsByType',
                       http_method='POST',
                       name='getConferenceSessionsByType')
     def getConferenceSessionsByType(self, request):
         """Return all sessions of a specific type, (by websafeConferenceKey)"""
-        q = Session.query()
-        q = q.filter(Session.websafeConferenceKey == request.websafeConferenceKey)
+        q = Session.query(ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
         q = q.filter(Session.typeOfSession == request.typeOfSession)
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in q]
+            items=SESSION_MAPPER.copy_all(q)
         )
 
-    @endpoints.method(SESSION_SPEAKER_GET_REQUEST,
+    @instrumentation.method(SESSION_SPEAKER_GET_REQUEST,
                       SessionForms,
                       path='getSessionsBySpeaker',
                       http_method='POST',
                       name='getSessionsBySpeaker')
     def getSessionsBySpeaker(self, request):
         """Return all sessions given a speaker,  across all conferences"""
-        q = Session.query()
-        q = q.filter(Session.speaker == request.speaker)
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in q]
-        )
-
-    @endpoints.method(SESSION_Date_GET_REQUEST,
+        speakerKey = self._speakerKey(request.speaker)
+        client = memcache.Client()
+        cacheKey = MEMCACHE_SPEAKER_KEY % speakerKey.id()
+        cached = client.get(cacheKey)
+        if cached is not None and cached[0] == CACHED_FORM:
+            return protobuf.decode_message(SessionForms, cached[1:])
+        # only the lease holder fills the entry in, with cas() so a new
+        # session that drops the entry meanwhile keeps it from being stored
+        leased = cached is None and client.add(cacheKey, CACHED_LEASE,
+                                               time=SPEAKER_LEASE_TTL)
+        if leased:
+            client.gets(cacheKey)
+
+        speaker = speakerKey.get()
+        if speaker:
+            sessions = [s for s in ndb.get_multi(speaker.sessionKeys) if s]
+        else:
+            # sessions written before the Speaker index existed
+            sessions = Session.query(Session.speaker == request.speaker).fetch()
+        sf = SessionForms(items=SESSION_MAPPER.copy_all(sessions))
+        if speaker and leased:
+            client.cas(cacheKey, CACHED_FORM + protobuf.encode_message(sf),
+                       time=SPEAKER_CACHE_TTL)
+        return sf
+
+    @instrumentation.method(SESSION_Date_GET_REQUEST,
                       SessionForms,
                       path='getSessionsByDate',
                       http_method='POST',
@@ -719,28 +1348,23 @@ class ConferenceApi(remote.Service):
         q = Session.query()
         q = q.filter(Session.date == datetime.strptime(request.date, "%Y-%m-%d").date())
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in q]
+            items=SESSION_MAPPER.copy_all(q)
         )
 
 
-    @endpoints.method(SESSION_Date_GET_REQUEST,
+    @instrumentation.method(SESSION_DATE_PAGE_GET_REQUEST,
                       SessionForms,
                       path='getMorningSessionsByDate',
                       http_method='POST',
                       name='getMorningSessionsByDate')
     def getMorningSessionsByDate(self, request):
-        """Return all sessions given a date,  across all conferences"""
+        """Return sessions starting before noon on a date, across all conferences"""
         q = Session.query()
         q = q.filter(Session.date == datetime.strptime(request.date, "%Y-%m-%d").date())
-        q = q.filter(ndb.AND(
-            Session.startTime <= datetime.strptime('12:00:00', '%H:%M:%S').time(),
-            Session.startTime > datetime.strptime('07:00:00', '%H:%M:%S').time()))
+        q = q.filter(Session.dayPart == 'morning')
+        return self._sessionPage(q.order(Session.key), request)
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in q]
-        )
-
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(PAGE_GET_REQUEST,
                       SessionForms,
                       path='getNonWorkshopSessionsBeforeSevenPM',
                       http_method='POST',
@@ -748,29 +1372,226 @@ class ConferenceApi(remote.Service):
     def getNonWorkshopSessionsBeforeSevenPM(self, request):
         """Return all non-workshop sessions before 7pm,  across all conferences"""
         q = Session.query()
-        q = q.filter(ndb.OR(Session.typeOfSession == 'keynote',
-                            Session.typeOfSession == 'lecture',
-                            Session.typeOfSession == 'others'
-                            )
-                     )
-        q = q.filter(Session.startTime <= datetime.strptime('19:00:00', '%H:%M:%S').time())
+        q = q.filter(Session.isWorkshop == False)
+        q = q.filter(Session.isEvening == False)
+        return self._sessionPage(q.order(Session.key), request)
 
-        return SessionForms(
-            items=[self._copySessionToForm(session) for session in q]
-        )
 
-
-    @endpoints.method(SESSION_GET_REQUEST,
+    @instrumentation.method(SESSION_GET_REQUEST,
                       SessionForms,
                       path='getConferenceSessions',
                       http_method='POST',
                       name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """Return all sessions.(by websafeConferenceKey)"""
-        q = Session.query()
-        q = q.filter(Session.websafeConferenceKey == request.websafeConferenceKey)
+        q = Session.query(ancestor=ndb.Key(urlsafe=request.websafeConferenceKey))
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in q]
+            items=SESSION_MAPPER.copy_all(q)
+        )
+
+# - - - Session key migration - - - - - - - - - - - - - - - -
+    @staticmethod
+    def _migrateSessionKeys(websafeCursor=None):
+        """Re-key one batch of Sessions under their real Conference;
+        returns the cursor of the next batch or None when done.
+        """
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        sessions, next_cursor, more = Session.query().order(Session.key).fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+        # sessions already parented to their conference only get their
+        # derived fields filled in
+        moving = [s for s in sessions
+                  if s.key.parent() != ndb.Key(urlsafe=s.websafeConferenceKey)]
+        moving_keys = set(s.key for s in moving)
+        upgraded, unindexed = [], []
+        for s in sessions:
+            if s.key in moving_keys:
+                continue
+            if not s.speakerKey:
+                s.speakerKey = ConferenceApi._speakerKey(s.speaker)
+                unindexed.append(s)
+            if ConferenceApi._classifySession(s) or s in unindexed:
+                s.speakerPending = True
+                upgraded.append(s)
+        ndb.put_multi(upgraded)
+        ConferenceApi._indexSessionSpeakers(unindexed)
+        pending = set(s.websafeConferenceKey for s in upgraded)
+        if moving:
+            moved, replaced = [], {}
+            for session in moving:
+                copy = ConferenceApi._copySession(session)
+                if copy:
+                    moved.append(copy)
+                    replaced[copy.key] = session.key
+            # the originals go only once their copies are indexed; a
+            # retried batch finds the copies through MovedSession
+            ConferenceApi._indexSessionSpeakers(moved, replaced)
+            searchindex.index_sessions(moved, replaced.values())
+            ndb.delete_multi([s.key for s in moving])
+            pending.update(s.websafeConferenceKey for s in moved)
+        # backfill the speaker aggregates of the sessions flagged above
+        if pending:
+            unitofwork.enqueue(*[ConferenceApi._featuredSpeakerTask(wsck)
+                                 for wsck in sorted(pending)])
+
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _copySession(session):
+        """Write the copy of a Session under its Conference together with
+        the MovedSession record pointing at it; returns the copy, or the
+        one an earlier attempt wrote (None if that copy is gone)."""
+        record_key = ndb.Key(MovedSession, session.key.urlsafe())
+        record = record_key.get()
+        if record:
+            return record.newKey.get()
+        c_key = ndb.Key(urlsafe=session.websafeConferenceKey)
+        s_id = Session.allocate_ids(size=1, parent=c_key)[0]
+        copy = Session(key=ndb.Key(Session, s_id, parent=c_key),
+                       **session.to_dict())
+        ConferenceApi._classifySession(copy)
+        copy.speakerKey = ConferenceApi._speakerKey(copy.speaker)
+        copy.speakerPending = True
+        ndb.put_multi([copy, MovedSession(key=record_key, newKey=copy.key)])
+        return copy
+
+    @staticmethod
+    def _migrateWishlistKeys(websafeCursor=None):
+        """Point one batch of Profile wishlists at the re-keyed Sessions;
+        returns the cursor of the next batch or None when done.
+        """
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        profiles, next_cursor, more = Profile.query().order(Profile.key).fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+        profiles = [p for p in profiles if p.sessionKeysToAttend]
+        old_keys = set(k for p in profiles for k in p.sessionKeysToAttend)
+        records = ndb.get_multi([ndb.Key(MovedSession, k) for k in old_keys])
+        moved = dict((r.key.id(), r.newKey.urlsafe()) for r in records if r)
+
+        changed = []
+        for prof in profiles:
+            keys = [moved.get(k, k) for k in prof.sessionKeysToAttend]
+            if keys != prof.sessionKeysToAttend:
+                prof.sessionKeysToAttend = keys
+                changed.append(prof)
+        ndb.put_multi(changed)
+
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+    def _formatSessionFilters(self, filters):
+        """Parse, check validity and convert user supplied session filters."""
+        formatted_filters = []
+        for f in filters:
+            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
+            try:
+                filtr["field"] = SESSION_FIELDS[filtr["field"]]
+                filtr["operator"] = OPERATORS[filtr["operator"]]
+            except KeyError:
+                raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+            if filtr["field"] == 'websafeConferenceKey' and filtr["operator"] != "=":
+                raise endpoints.BadRequestException("CONFERENCE only supports EQ.")
+
+            # convert values to the property's type
+            try:
+                if filtr["field"] == 'date':
+                    filtr["value"] = datetime.strptime(filtr["value"], "%Y-%m-%d").date()
+                elif filtr["field"] == 'startTime':
+                    # a missing value falls through to strptime's TypeError
+                    fmt = '%H:%M:%S' if (filtr["value"] or '').count(':') == 2 else '%H:%M'
+                    filtr["value"] = datetime.strptime(filtr["value"], fmt).time()
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Bad value for %s: %s" % (filtr["field"], filtr["value"]))
+            formatted_filters.append(filtr)
+        return formatted_filters
+
+    def _planSessionQuery(self, filters):
+        """Split session filters into a datastore query & in-memory predicates.
+
+        The query gets a conference ancestor and the equality filters, most
+        selective first; built-in indexes serve those with a merge join. An
+        inequality only goes to the datastore when nothing else does or when
+        index.yaml has a composite index for it with the single equality
+        filter. Everything else is checked in memory. Returns (query,
+        predicates).
+        """
+        equalities = [f for f in filters if f["operator"] == "="]
+        inequalities = [f for f in filters if f["operator"] != "="]
+        equalities.sort(key=lambda f: SESSION_EQUALITY_RANK.index(f["field"])
+                        if f["field"] in SESSION_EQUALITY_RANK else len(SESSION_EQUALITY_RANK))
+
+        pushed = []
+        ancestor = None
+        for f in equalities:
+            if f["field"] == 'websafeConferenceKey':
+                if ancestor is None:
+                    ancestor = ndb.Key(urlsafe=f["value"])
+                    pushed.append(f)
+            else:
+                pushed.append(f)
+
+        # the datastore takes at most one inequality property; "!=" stays
+        # in memory since it would split the query and lose the cursor
+        inequality = None
+        ranges = [f for f in inequalities if f["operator"] != "!="]
+        if ranges:
+            first = ranges[0]["field"]
+            pushed_eq = [f["field"] for f in pushed]
+            if ancestor is None and (not pushed_eq or
+                                     (len(pushed_eq) == 1 and
+                                      (pushed_eq[0], first) in SESSION_INDEXED_PAIRS)):
+                inequality = first
+                pushed.extend(f for f in ranges if f["field"] == first)
+
+        q = Session.query(ancestor=ancestor)
+        for f in pushed:
+            if f["field"] != 'websafeConferenceKey':
+                q = q.filter(ndb.query.FilterNode(f["field"], f["operator"], f["value"]))
+        if inequality:
+            q = q.order(ndb.GenericProperty(inequality))
+        q = q.order(Session.key)
+
+        predicates = [(operator.attrgetter(f["field"]), PREDICATES[f["operator"]], f["value"])
+                      for f in filters if f not in pushed]
+        return q, predicates
+
+    @instrumentation.method(SessionQueryForms,
+                      SessionForms,
+                      path='querySessions',
+                      http_method='POST',
+                      name='querySessions')
+    def querySessions(self, request):
+        """Query for sessions on any combination of filters, one page at a time."""
+        q, predicates = self._planSessionQuery(
+            self._formatSessionFilters(request.filters))
+        page_size, start_cursor = self._pageArgs(request)
+
+        # stream the query, keeping what passes the in-memory predicates
+        sessions = []
+        it = q.iter(start_cursor=start_cursor, produce_cursors=True)
+        scanned = 0
+        for session in it:
+            scanned += 1
+            if all(test(get(session), value) for get, test, value in predicates):
+                sessions.append(session)
+                if len(sessions) == page_size:
+                    break
+            if scanned >= MAX_SESSION_SCAN:
+                break
+
+        next_token = None
+        if scanned and it.has_next():
+            next_token = it.cursor_after().urlsafe()
+        return SessionForms(
+            items=SESSION_MAPPER.copy_all(sessions),
+            nextPageToken=next_token
         )
 
 # ----------------------------------------------------------------------------------
@@ -778,56 +1599,47 @@ class ConferenceApi(remote.Service):
 # ----------------------------------------------------------------------------------
 
     def _createWishlistObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        session = ndb.Key(urlsafe=request.SessionKey).get()
-        # check that conference exists
+        # the Profile itself is read in _updateProfile's transaction
+        session = unitofwork.get(ndb.Key(urlsafe=request.SessionKey))
+        # check that session exists
         if not session:
             raise endpoints.NotFoundException(
-                'No session found with key: %s' % request.websafeConferenceKey)
+                'No session found with key: %s' % request.SessionKey)
 
-        # check that user is owner
-        prof = self._getProfileFromUser()
         session_key = request.SessionKey
-        if session_key in prof.sessionKeysToAttend:
+
+        def change(prof):
+            if session_key in prof.sessionKeysToAttend:
                 raise ConflictException(
                     "You have already added this session to your wishlist!")
-        else:
             prof.sessionKeysToAttend.append(session_key)
-
-        prof.put()
-        return self._copyProfileToForm(prof)
+        self._updateProfile(change)
+        return self._copyProfileToForm(self._profile)
 
     def _deleteWishlistObject(self, request):
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
-
-        session = ndb.Key(urlsafe=request.SessionKey).get()
-        # check that conference exists
+        # the Profile itself is read in _updateProfile's transaction
+        session = unitofwork.get(ndb.Key(urlsafe=request.SessionKey))
+        # check that session exists
         if not session:
             raise endpoints.NotFoundException(
-                'No session found with key: %s' % request.websafeConferenceKey)
+                'No session found with key: %s' % request.SessionKey)
 
-        # check that user is owner
-        prof = self._getProfileFromUser()
         session_key = request.SessionKey
-        if session_key not in prof.sessionKeysToAttend:
+
+        def change(prof):
+            if session_key not in prof.sessionKeysToAttend:
                 raise ConflictException(
                     "This session is not in your wishlist!")
-        else:
             prof.sessionKeysToAttend.remove(session_key)
+        self._updateProfile(change)
+        return self._copyProfileToForm(self._profile)
 
-        prof.put()
-        return self._copyProfileToForm(prof)
-
-    @endpoints.method(WISHLIST_GET_REQUEST,
+    @instrumentation.method(WISHLIST_GET_REQUEST,
                       ProfileForm,
                       path='wishlist',
                       http_method='POST',
                       name='addSessionToWishlist')
+    @unitofwork.endpoint
     def addSessionToWishlist(self, request):
         """Create new Session.(by websafeSessionKey)"""
         if not request.SessionKey:
@@ -835,11 +1647,12 @@ class ConferenceApi(remote.Service):
 
         return self._createWishlistObject(request)
 
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(message_types.VoidMessage,
                       SessionForms,
                       path='sessions/wishlist',
                       http_method='GET',
                       name='getSessionsInWishlist')
+    @unitofwork.endpoint
     def getSessionsInWishlist(self, request):
         """Get list of Sessions that user has put in their wish list."""
         prof = self._getProfileFromUser() # get user Profile
@@ -848,14 +1661,15 @@ class ConferenceApi(remote.Service):
 
         # return set of ConferenceForm objects per Conference
         return SessionForms(
-            items=[self._copySessionToForm(session) for session in sessions]
+            items=SESSION_MAPPER.copy_all(sessions)
         )
 
-    @endpoints.method(WISHLIST_GET_REQUEST,
+    @instrumentation.method(WISHLIST_GET_REQUEST,
                       ProfileForm,
                       path='wishlist',
                       http_method='GET',
                       name='deleteSessionInWishlist')
+    @unitofwork.endpoint
     def deleteSessionInWishlist(self, request):
         """delete Session in the wish list .(by websafeSessionKey)"""
         if not request.SessionKey:
@@ -866,39 +1680,109 @@ class ConferenceApi(remote.Service):
 
 # task memcache
     @staticmethod
-    def _cacheFeatureSpeaker(websafeConferenceKey, speaker):
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+    @ndb.transactional()
+    def _featurePendingSessions(c_key, s_keys):
+        """Add pending sessions to their speakers' per-conference aggregates
+        and feature whichever speaker now has the most sessions, the one
+        already featured included (it keeps a tie). Returns (pending flags
+        cleared, featured speaker's aggregate or None), or None if the
+        conference is gone; its sessions are cleared all the same.
         """
-        q = Session.query()
-        q.filter(Session.websafeConferenceKey == websafeConferenceKey)
-        q.filter(Session.speaker ==speaker)
-        sessionNames = [session.name for session in q]
-
-        if len(sessionNames) > 0:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            featureSpeaker = ('The featured speaker '+speaker+' has the following Sessions: %s')
-
-            announcement = featureSpeaker % (
-                ', '.join(sn for sn in sessionNames))
-            memcache.set(MEMCACHE_FEATURESPEAKER_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_FEATURESPEAKER_KEY)
+        conf = c_key.get()
+        sessions = [s for s in ndb.get_multi(s_keys) if s and s.speakerPending]
+        bySpeaker = {}
+        for session in sessions:
+            session.speakerPending = None
+            if session.speaker:
+                bySpeaker.setdefault(session.speaker, []).append(session)
+        if not conf:
+            ndb.put_multi(sessions)
+            return None
+
+        speakers = list(bySpeaker)
+        if conf.featuredSpeaker and conf.featuredSpeaker not in bySpeaker:
+            speakers.append(conf.featuredSpeaker)
+        entries = ndb.get_multi([ndb.Key(ConferenceSpeaker, speaker, parent=c_key)
+                                 for speaker in speakers])
+        featured, changed = None, []
+        for speaker, entry in zip(speakers, entries):
+            if speaker in bySpeaker:
+                if not entry:
+                    entry = ConferenceSpeaker(id=speaker, parent=c_key)
+                # tasks can run more than once; only count each session once
+                for session in bySpeaker[speaker]:
+                    if session.key.urlsafe() not in entry.sessionKeys:
+                        entry.sessionKeys.append(session.key.urlsafe())
+                        entry.sessionNames.append(session.name)
+                changed.append(entry)
+            elif not entry:
+                continue
+            count = len(entry.sessionKeys)
+            best = len(featured.sessionKeys) if featured else -1
+            if count > best or (count == best and speaker == conf.featuredSpeaker):
+                featured = entry
+        if featured and featured.key.id() != conf.featuredSpeaker:
+            conf.featuredSpeaker = featured.key.id()
+            changed.append(conf)
+        ndb.put_multi(changed + sessions)
+        return len(sessions), featured
 
+    @staticmethod
+    def _refreshFeaturedSpeaker(websafeConferenceKey):
+        """Fold the sessions added since the last refresh into the speaker
+        aggregates & cache the featured speaker; used by the debounced
+        set_featured_speaker task.
+        """
+        c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        q = Session.query(ancestor=c_key).filter(Session.speakerPending == True)
+        entry = None
+        while True:
+            s_keys = q.fetch(FEATURED_SPEAKER_BATCH_SIZE, keys_only=True)
+            if not s_keys:
+                break
+            result = ConferenceApi._featurePendingSessions(c_key, s_keys)
+            # stop on a missing conference or a batch that cleared nothing,
+            # which the next query would only return again
+            if result is None:
+                break
+            cleared, featured = result
+            entry = featured or entry
+            if not cleared or len(s_keys) < FEATURED_SPEAKER_BATCH_SIZE:
+                break
+        if not entry:
+            return ""
+
+        announcement = FEATURED_SPEAKER_TPL % (
+            entry.key.id(), ', '.join(entry.sessionNames))
+        memcache.set(MEMCACHE_FEATURESPEAKER_KEY % websafeConferenceKey, announcement)
         return announcement
 
-    @endpoints.method(message_types.VoidMessage,
+    @instrumentation.method(CONF_GET_REQUEST,
                       StringMessage,
                       path='conference/featureSpeaker/get',
                       http_method='GET',
                       name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_FEATURESPEAKER_KEY) or "")
+        """Return the featured speaker of a conference (by websafeConferenceKey)."""
+        if not request.websafeConferenceKey:
+            raise endpoints.BadRequestException("'websafeConferenceKey' field required")
+        key = MEMCACHE_FEATURESPEAKER_KEY % request.websafeConferenceKey
+        announcement = memcache.get(key)
+        if announcement is None:
+            # rebuild from the stored aggregate; no session scan needed
+            c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+            conf = c_key.get()
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            announcement = ""
+            if conf.featuredSpeaker:
+                entry = ndb.Key(ConferenceSpeaker, conf.featuredSpeaker, parent=c_key).get()
+                if entry:
+                    announcement = FEATURED_SPEAKER_TPL % (
+                        conf.featuredSpeaker, ', '.join(entry.sessionNames))
+            memcache.set(key, announcement)
+        return StringMessage(data=announcement)
 
 
 api = endpoints.api_server([ConferenceApi]) # register API
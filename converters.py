@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""converters.py
+
+Copies ndb entities onto ProtoRPC form messages. The list of fields to copy
+and the conversion for each one is worked out once per (model, form) pair
+instead of by reflecting over all_fields() for every entity.
+
+"""
+
+import operator
+
+from protorpc import messages
+
+
+def _toString(value):
+    return str(value)
+
+
+def _websafeKey(entity):
+    return entity.key.urlsafe()
+
+
+def _enumByName(enum_type):
+    """Return a converter from an enum value name to the Enum member."""
+    members = dict((member.name, member) for member in enum_type)
+    return members.__getitem__
+
+
+def _compose(convert, get):
+    return lambda entity: convert(get(entity))
+
+
+class FormMapper(object):
+    """FormMapper -- copies one ndb model class onto one form class"""
+
+    def __init__(self, model_class, form_class):
+        self.form_class = form_class
+        self.plan = []
+        for field in form_class.all_fields():
+            name = field.name
+            if hasattr(model_class, name):
+                get = operator.attrgetter(name)
+                # convert t-shirt string etc. to Enum; Date/Time to string;
+                # just copy others
+                if isinstance(field, messages.EnumField):
+                    get = _compose(_enumByName(field.type), get)
+                elif name.endswith(('Date', 'date', 'Time')):
+                    get = _compose(_toString, get)
+                self.plan.append((name, get))
+            elif name == 'websafeKey':
+                self.plan.append((name, _websafeKey))
+
+    def copy(self, entity, **overrides):
+        """Return a form for entity; overrides replace copied values."""
+        form = self.form_class()
+        for name, get in self.plan:
+            setattr(form, name, get(entity))
+        for name, value in overrides.items():
+            setattr(form, name, value)
+        form.check_initialized()
+        return form
+
+    def copy_all(self, entities):
+        """Return a list of forms, one per entity."""
+        copy = self.copy
+        return [copy(entity) for entity in entities]
+
+
+_mappers = {}
+
+
+def mapper(model_class, form_class):
+    """Return the (shared) FormMapper for a model/form class pair."""
+    key = (model_class, form_class)
+    if key not in _mappers:
+        _mappers[key] = FormMapper(model_class, form_class)
+    return _mappers[key]
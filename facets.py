@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+How many Conferences there are per city, topic and start month, so the
+conference filters can be built from one cached read instead of a scan of
+the Conference kind. Each value has its own FacetCount entity.
+
+Writing a Conference enqueues a count task in the same transaction. The
+task compares the Conference's current values with the ones it was last
+counted under (a CountedFacets child of the Conference) and moves it
+between counters in a transaction, so a retried or repeated task counts
+it once and a deleted Conference is taken off its counters.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Conference
+from models import CountedFacets
+from models import FacetCount
+
+FACETS = ('city', 'topic', 'month')
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+FACETS_CACHE_TTL = 600
+# a transaction spans at most 25 entity groups; one is the Conference's
+MAX_COUNTERS_PER_TXN = 24
+RECOUNT_BATCH_SIZE = 100
+
+
+def facet_ids(conf):
+    """Return the ids of the FacetCounts a Conference belongs in."""
+    if not conf:
+        return []
+    ids = []
+    if conf.city:
+        ids.append(u'city:%s' % conf.city)
+    for topic in sorted(set(conf.topics or [])):
+        ids.append(u'topic:%s' % topic)
+    if conf.month:
+        ids.append(u'month:%d' % conf.month)
+    return ids
+
+
+def count_task(websafeConferenceKeys):
+    """Return the task that brings the counts of Conferences up to date."""
+    return taskqueue.Task(url='/tasks/count_facets',
+                          params={'websafeConferenceKeys': ','.join(websafeConferenceKeys)})
+
+
+def _countedKey(c_key):
+    return ndb.Key(CountedFacets, 1, parent=c_key)
+
+
+@ndb.transactional(xg=True)
+def _countChunk(c_key):
+    """Move a Conference onto (or off) up to MAX_COUNTERS_PER_TXN of the
+    counters it is out of step with; returns False when it is in step."""
+    conf, counted = ndb.get_multi([c_key, _countedKey(c_key)])
+    counted = counted or CountedFacets(key=_countedKey(c_key))
+    wanted = facet_ids(conf)
+    have = set(counted.facetIds)
+    changes = ([(f, 1) for f in wanted if f not in have] +
+               [(f, -1) for f in sorted(have) if f not in wanted])[:MAX_COUNTERS_PER_TXN]
+    if not changes:
+        return False
+
+    counters = ndb.get_multi([ndb.Key(FacetCount, f) for f, delta in changes])
+    changed, emptied = [counted], []
+    for (f, delta), counter in zip(changes, counters):
+        if counter is None:
+            facet, value = f.split(':', 1)
+            counter = FacetCount(id=f, facet=facet, value=value)
+        counter.count += delta
+        if counter.count > 0:
+            changed.append(counter)
+        else:
+            emptied.append(counter.key)
+        if delta > 0:
+            have.add(f)
+        else:
+            have.discard(f)
+    counted.facetIds = sorted(have)
+    ndb.put_multi(changed)
+    ndb.delete_multi(emptied)
+    return True
+
+
+def count_conferences(websafeConferenceKeys):
+    """Bring the counters in step with Conferences; drops the cached counts
+    if any of them moved."""
+    moved = False
+    for wsck in websafeConferenceKeys:
+        c_key = ndb.Key(urlsafe=wsck)
+        while _countChunk(c_key):
+            moved = True
+    if moved:
+        memcache.delete(MEMCACHE_FACETS_KEY)
+    return moved
+
+
+def recount_batch(websafeCursor=None):
+    """Queue the counting of one batch of Conferences; returns the cursor
+    of the next batch or None when done."""
+    cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    keys, next_cursor, more = Conference.query().order(Conference.key).fetch_page(
+        RECOUNT_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    if keys:
+        count_task([k.urlsafe() for k in keys]).add()
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
+
+
+def get_facets():
+    """Return {facet: [(value, count)]}, most common values first."""
+    facets = memcache.get(MEMCACHE_FACETS_KEY)
+    if facets is None:
+        facets = dict((facet, []) for facet in FACETS)
+        for counter in FacetCount.query():
+            facets.setdefault(counter.facet, []).append((counter.value, counter.count))
+        for values in facets.values():
+            values.sort(key=lambda v: (-v[1], v[0]))
+        memcache.set(MEMCACHE_FACETS_KEY, facets, time=FACETS_CACHE_TTL)
+    return facets
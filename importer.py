@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+
+"""importer.py
+
+Bulk import of Conferences, Sessions and Profiles from JSONL or CSV
+uploads. Rows are streamed, validated against the ConferenceForm,
+SessionForm or ProfileMiniForm fields and written in put_multi chunks.
+Profiles are keyed by user id, so importing one again updates it.
+Progress is checkpointed on an ImportJob so a failed import can be re-run
+with the same job id and picks up after the last committed chunk.
+
+"""
+
+import csv
+import json
+import time
+
+import endpoints
+from protorpc import messages
+from google.appengine.ext import ndb
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import ImportJob
+from models import Profile
+from models import ProfileMiniForm
+from models import Session
+from models import SessionForm
+from models import TeeShirtSize
+
+import facets
+import searchindex
+import seats
+import unitofwork
+
+CHUNK_SIZE = 100
+# columns a row may carry besides the form fields
+EXTRA_COLUMNS = {
+    'conference': set(),
+    'session': set(['websafeConferenceKey']),
+    # user ids are emails, so either one names the Profile
+    'profile': set(['userId', 'mainEmail']),
+}
+# fields the server fills in; a row may not set them
+READ_ONLY_FIELDS = set(['websafeKey', 'organizerDisplayName', 'seatsAvailable', 'month'])
+FORMS = {
+    'conference': ConferenceForm,
+    'session': SessionForm,
+    'profile': ProfileMiniForm,
+}
+
+
+class ImportRowError(Exception):
+    """ImportRowError -- a row (or job) that can't be imported"""
+
+
+def _readRows(stream, fmt):
+    """Yield one dict per row of a JSONL or CSV stream."""
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield dict((k, v.decode('utf-8')) for k, v in row.items() if v not in (None, ''))
+    else:
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _toForm(kind, row, lineno):
+    """Validate a row against the form fields & return (form, extras)."""
+    form_class = FORMS[kind]
+    allowed = set(f.name for f in form_class.all_fields()) - READ_ONLY_FIELDS
+    unknown = set(row) - allowed - EXTRA_COLUMNS[kind]
+    if unknown:
+        raise ImportRowError('row %d: unknown fields %s' % (lineno, ', '.join(sorted(unknown))))
+
+    form = form_class()
+    for name, value in row.items():
+        if name not in allowed:
+            continue
+        field = form_class.field_by_name(name)
+        try:
+            if field.repeated and not isinstance(value, list):
+                # CSV cells hold repeated values separated by ';'
+                value = [v.strip() for v in value.split(';') if v.strip()]
+            if isinstance(field, messages.IntegerField):
+                value = [int(v) for v in value] if field.repeated else int(value)
+            setattr(form, name, value)
+        except (ValueError, TypeError, messages.ValidationError) as e:
+            raise ImportRowError('row %d: bad value for %s: %s' % (lineno, name, e))
+    extras = dict((k, row[k]) for k in EXTRA_COLUMNS[kind] if k in row)
+    return form, extras
+
+
+def _parentKey(kind, form, extras, organizerUserId, lineno):
+    """Return the key entities for this row are created under; for a
+    Profile, its own key."""
+    if kind == 'profile':
+        user_id = extras.get('userId') or extras.get('mainEmail')
+        if not user_id:
+            raise ImportRowError('row %d: userId or mainEmail required' % lineno)
+        return ndb.Key(Profile, user_id)
+    if kind == 'conference':
+        user_id = form.organizerUserId or organizerUserId
+        if not user_id:
+            raise ImportRowError('row %d: no organizerUserId' % lineno)
+        return ndb.Key(Profile, user_id)
+    if not extras.get('websafeConferenceKey'):
+        raise ImportRowError('row %d: websafeConferenceKey required' % lineno)
+    try:
+        return ndb.Key(urlsafe=extras['websafeConferenceKey'])
+    except Exception:
+        raise ImportRowError('row %d: bad websafeConferenceKey' % lineno)
+
+
+def _allocateKeys(kind, parents):
+    """Return one new key per parent, using one id range per parent."""
+    model = Conference if kind == 'conference' else Session
+    counts = {}
+    for parent in parents:
+        counts[parent] = counts.get(parent, 0) + 1
+    ranges = {}
+    for parent, count in counts.items():
+        first, last = model.allocate_ids(size=count, parent=parent)
+        ranges[parent] = iter(range(first, last + 1))
+    return [ndb.Key(model, next(ranges[parent]), parent=parent) for parent in parents]
+
+
+def _buildEntities(kind, forms, keys, loaded):
+    """Return (entities to put, tasks to enqueue) for one chunk."""
+    entities, tasks = [], []
+    for (form, extras, lineno), key in zip(forms, keys):
+        try:
+            if kind == 'conference':
+                conf = ConferenceApi._conferenceFromForm(
+                    form, key.parent().id(), key)
+                prof = loaded.get(key.parent())
+                conf.organizerDisplayName = prof.displayName if prof else None
+                entities.append(conf)
+                entities.extend(seats.new_shards(key, conf.seatsAvailable))
+            elif kind == 'session':
+                conf = loaded.get(key.parent())
+                if not conf:
+                    raise ImportRowError('row %d: no conference %s' % (
+                        lineno, key.parent().urlsafe()))
+                session = ConferenceApi._sessionFromForm(
+                    form, conf, conf.organizerUserId, key)
+                entities.append(session)
+                tasks.append(ConferenceApi._featuredSpeakerTask(session.websafeConferenceKey))
+            else:
+                prof = loaded.get(key)
+                oldDisplayName = prof.displayName if prof else None
+                if not prof:
+                    prof = loaded[key] = Profile(
+                        key=key, displayName=key.id(), mainEmail=key.id(),
+                        teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED))
+                if extras.get('mainEmail'):
+                    prof.mainEmail = extras['mainEmail']
+                if form.displayName:
+                    prof.displayName = form.displayName
+                if form.teeShirtSize:
+                    prof.teeShirtSize = str(form.teeShirtSize)
+                entities.append(prof)
+                # conferences carry a copy of the organizer's name
+                if oldDisplayName is not None and prof.displayName != oldDisplayName:
+                    tasks.append(ConferenceApi._organizerNameTask(key.id()))
+        except (endpoints.BadRequestException, ValueError) as e:
+            raise ImportRowError('row %d: %s' % (lineno, e))
+    return entities, tasks
+
+
+def _writeChunk(job, kind, chunk, loaded):
+    """Write one chunk of (form, extras, lineno, parent) rows."""
+    forms = [(form, extras, lineno) for form, extras, lineno, parent in chunk]
+    parents = [parent for form, extras, lineno, parent in chunk]
+
+    # organizer Profiles or Conferences the rows are created under, or
+    # the Profiles being imported
+    missing = [p for p in set(parents) if p not in loaded]
+    for key, entity in zip(missing, ndb.get_multi(missing)):
+        loaded[key] = entity
+
+    if kind == 'profile':
+        # a resumed import writes the same Profiles again
+        keys = parents
+    else:
+        # reuse the ids reserved by an earlier attempt at this chunk so a
+        # resumed import overwrites, rather than duplicates, what it wrote
+        keys = [ndb.Key(urlsafe=k) for k in job.pendingKeys]
+        if [k.parent() for k in keys] != parents:
+            keys = _allocateKeys(kind, parents)
+            job.pendingKeys = [k.urlsafe() for k in keys]
+            job.put()
+
+    entities, tasks = _buildEntities(kind, forms, keys, loaded)
+    ndb.put_multi(entities)
+    if kind == 'session':
+        ConferenceApi._indexSessionSpeakers(entities)
+        searchindex.index_sessions(entities)
+    elif kind == 'conference':
+        conferences = [e for e in entities if isinstance(e, Conference)]
+        searchindex.index_conferences(conferences)
+        tasks.append(facets.count_task([c.key.urlsafe() for c in conferences]))
+    # one named refresh per conference & window, however many rows
+    unitofwork.enqueue(*tasks)
+
+    job.rowsCommitted += len(chunk)
+    job.entitiesWritten += len(entities)
+    job.pendingKeys = []
+
+
+def runImport(job_id, kind, stream, fmt='jsonl', organizerUserId=None):
+    """Import rows from stream under job_id; return the ImportJob.
+
+    Rows already committed by an earlier run of the same job are skipped.
+    Raises ImportRowError on the first invalid row, after checkpointing
+    everything before it.
+    """
+    if not job_id:
+        raise ImportRowError('a job id is required')
+    if kind not in FORMS:
+        raise ImportRowError('unknown kind: %s' % kind)
+    job = ImportJob.get_or_insert(job_id, kind=kind)
+    if job.kind != kind:
+        raise ImportRowError('job %s imports %ss' % (job_id, job.kind))
+
+    started = time.time()
+    written = job.entitiesWritten
+    loaded = {}
+    chunk = []
+    try:
+        for lineno, row in enumerate(_readRows(stream, fmt), 1):
+            if lineno <= job.rowsCommitted:
+                continue
+            form, extras = _toForm(kind, row, lineno)
+            parent = _parentKey(kind, form, extras, organizerUserId, lineno)
+            chunk.append((form, extras, lineno, parent))
+            if len(chunk) == CHUNK_SIZE:
+                _writeChunk(job, kind, chunk, loaded)
+                job.put()
+                chunk = []
+        if chunk:
+            _writeChunk(job, kind, chunk, loaded)
+        job.done = True
+    finally:
+        elapsed = time.time() - started
+        job.seconds = (job.seconds or 0.0) + elapsed
+        if elapsed > 0:
+            job.entitiesPerSecond = (job.entitiesWritten - written) / elapsed
+        job.put()
+    return job
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""instrumentation.py
+
+Per-endpoint latency & RPC counts for ConferenceApi. instrumentation.method
+is endpoints.method plus a wrapper that times the call and counts the API
+RPCs it makes (via an apiproxy pre-call hook). Each call adds its numbers
+to a randomly picked shard of memcache counters in a single offset_multi;
+a cron job folds the shards into EndpointStats entities. Latencies are
+kept as a log-scale histogram so percentiles can be read back.
+
+"""
+
+import functools
+import math
+import random
+import threading
+import time
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import EndpointStats
+
+NUM_SHARDS = 4
+MEMCACHE_STATS_KEY = "ENDPOINT_STATS:%s:%d:%s"
+# latency bucket i holds calls that took up to BUCKET_BASE ** i ms
+BUCKET_BASE = 1.2
+NUM_BUCKETS = 64
+PERCENTILES = (50, 95, 99)
+DATASTORE_CALLS = ('Get', 'Put', 'Delete', 'RunQuery', 'Next',
+                   'BeginTransaction', 'Commit', 'AllocateIds')
+RPC_NAMES = (['datastore_v3.%s' % call for call in DATASTORE_CALLS] +
+             ['datastore_v3.other', 'memcache', 'urlfetch', 'taskqueue',
+              'mail', 'search', 'other'])
+
+_local = threading.local()
+_endpoints = []
+
+
+def _rpcName(service, call):
+    if service == 'datastore_v3':
+        return 'datastore_v3.%s' % (call if call in DATASTORE_CALLS else 'other')
+    return service if service in RPC_NAMES else 'other'
+
+
+def _countRpc(service, call, request, response):
+    counts = getattr(_local, 'rpcs', None)
+    if counts is not None:
+        name = _rpcName(service, call)
+        counts[name] = counts.get(name, 0) + 1
+
+
+def _installHook():
+    # Append ignores a hook name it already has; checked per call since
+    # testbed swaps in a fresh apiproxy
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('instrumentation', _countRpc)
+
+
+def _bucket(ms):
+    if ms <= 1:
+        return 0
+    return min(int(math.ceil(math.log(ms, BUCKET_BASE))), NUM_BUCKETS - 1)
+
+
+def _record(name, ms, rpcs):
+    """Add one call to a random shard of the endpoint's counters."""
+    shard = random.randint(0, NUM_SHARDS - 1)
+    deltas = {
+        MEMCACHE_STATS_KEY % (name, shard, 'calls'): 1,
+        MEMCACHE_STATS_KEY % (name, shard, 'ms'): int(round(ms)),
+        MEMCACHE_STATS_KEY % (name, shard, 'bucket%d' % _bucket(ms)): 1,
+    }
+    for rpc, count in rpcs.items():
+        deltas[MEMCACHE_STATS_KEY % (name, shard, rpc)] = count
+    memcache.offset_multi(deltas, initial_value=0)
+
+
+def _timed(func):
+    name = func.__name__
+    _endpoints.append(name)
+
+    @functools.wraps(func)
+    def wrapper(self, request):
+        _installHook()
+        outer = getattr(_local, 'rpcs', None)
+        _local.rpcs = {}
+        started = time.time()
+        try:
+            return func(self, request)
+        finally:
+            ms = (time.time() - started) * 1000
+            rpcs, _local.rpcs = _local.rpcs, outer
+            _record(name, ms, rpcs)
+    return wrapper
+
+
+def method(*args, **kwargs):
+    """endpoints.method that also records latency & RPC counts."""
+    def decorator(func):
+        return endpoints.method(*args, **kwargs)(_timed(func))
+    return decorator
+
+
+# - - - reading & flushing - - - - - - - - - - - - - - - - - - - - - - -
+
+def _statNames():
+    return (['calls', 'ms'] + list(RPC_NAMES) +
+            ['bucket%d' % i for i in range(NUM_BUCKETS)])
+
+
+def _readShards(name):
+    """Return ({stat: total over the shards}, {memcache key: value})."""
+    keys = [MEMCACHE_STATS_KEY % (name, shard, stat)
+            for shard in range(NUM_SHARDS) for stat in _statNames()]
+    values = memcache.get_multi(keys)
+    totals = {}
+    for key, value in values.items():
+        stat = key.rsplit(':', 1)[1]
+        totals[stat] = totals.get(stat, 0) + int(value)
+    return totals, values
+
+
+@ndb.transactional()
+def _addToStats(name, totals):
+    stats = EndpointStats.get_by_id(name) or EndpointStats(id=name)
+    stats.calls += totals.get('calls', 0)
+    stats.totalMs += totals.get('ms', 0)
+    rpcs = dict(stats.rpcs or {})
+    for rpc in RPC_NAMES:
+        if totals.get(rpc):
+            rpcs[rpc] = rpcs.get(rpc, 0) + totals[rpc]
+    stats.rpcs = rpcs
+    buckets = list(stats.buckets) + [0] * (NUM_BUCKETS - len(stats.buckets))
+    for i in range(NUM_BUCKETS):
+        buckets[i] += totals.get('bucket%d' % i, 0)
+    stats.buckets = buckets
+    stats.put()
+
+
+def flush():
+    """Fold the memcache shards of every endpoint into EndpointStats."""
+    for name in _endpoints:
+        totals, values = _readShards(name)
+        if not totals.get('calls'):
+            continue
+        _addToStats(name, totals)
+        # take off only what was folded in; calls recorded meanwhile stay
+        memcache.offset_multi(dict((key, -int(value)) for key, value in values.items()))
+
+
+def _percentile(buckets, calls, pct):
+    rank = calls * pct / 100.0
+    seen = 0
+    for i, count in enumerate(buckets):
+        seen += count
+        if seen >= rank:
+            return round(BUCKET_BASE ** i, 1)
+    return None
+
+
+def report():
+    """Return {endpoint: summary} over flushed & not yet flushed calls."""
+    stored = dict((s.key.id(), s) for s in
+                  ndb.get_multi([ndb.Key(EndpointStats, name) for name in _endpoints]) if s)
+    result = {}
+    for name in _endpoints:
+        totals = _readShards(name)[0]
+        stats = stored.get(name)
+        calls = totals.get('calls', 0) + (stats.calls if stats else 0)
+        if not calls:
+            continue
+        buckets = [totals.get('bucket%d' % i, 0) for i in range(NUM_BUCKETS)]
+        rpcs = dict((rpc, totals.get(rpc, 0)) for rpc in RPC_NAMES)
+        ms = totals.get('ms', 0)
+        if stats:
+            buckets = [a + b for a, b in zip(buckets, list(stats.buckets) + [0] * NUM_BUCKETS)]
+            for rpc, count in (stats.rpcs or {}).items():
+                rpcs[rpc] = rpcs.get(rpc, 0) + count
+            ms += stats.totalMs
+        summary = {'calls': calls, 'meanMs': round(float(ms) / calls, 1)}
+        for pct in PERCENTILES:
+            summary['p%d' % pct] = _percentile(buckets, calls, pct)
+        summary['rpcsPerCall'] = dict((rpc, round(float(count) / calls, 2))
+                                      for rpc, count in rpcs.items() if count)
+        result[name] = summary
+    return result
@@ -12,42 +12,216 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+import logging
+
 import webapp2
-from google.appengine.api import app_identity
-from google.appengine.api import mail
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
+from models import ImportJob
+
+import facets
+import importer
+import instrumentation
+import notifications
+import searchindex
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
-        ConferenceApi._cacheAnnouncement()
+        """Check the nearly sold out set & set Announcement in Memcache."""
+        ConferenceApi._checkAnnouncement()
         self.response.set_status(204)
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
+        """Send email confirming Conference creation (push tasks queued
+        before confirmations moved to the digest pull queue)."""
+        notifications.send_confirmation(self.request.get('email'),
+                                        [self.request.get('conferenceInfo')])
+
+
+class SendConfirmationDigestsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Mail queued creation confirmations as per-recipient digests."""
+        stats = notifications.send_digests()
+        logging.info('confirmation digests: %(messagesSent)d messages for '
+                     '%(notifications)d notifications', stats)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(stats))
 
 class SetFeaturedSpeakerlHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
-        websafeConferenceKey = self.request.get('websafeConferenceKey')
-        speaker              = self.request.get('speaker')
-        ConferenceApi._cacheFeatureSpeaker(websafeConferenceKey,speaker)
+        """Refresh the featured speaker from the sessions added lately."""
+        ConferenceApi._refreshFeaturedSpeaker(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class SyncSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy sharded seat counts back onto the Conference."""
+        ConferenceApi._syncSeatsAvailable(
+            self.request.get('websafeConferenceKey'))
+        self.response.set_status(204)
+
+class MigrateSessionKeysHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start re-keying Sessions under their Conference."""
+        taskqueue.add(url='/tasks/migrate_session_keys',
+                      params={'phase': 'sessions'})
+        self.response.set_status(202)
+
+    def post(self):
+        """Migrate one batch & chain a task for the next one."""
+        phase = self.request.get('phase')
+        cursor = self.request.get('cursor') or None
+        if phase == 'sessions':
+            cursor = ConferenceApi._migrateSessionKeys(cursor)
+            if not cursor:
+                # every session is moved; now fix up the wishlists
+                phase = 'wishlists'
+        elif phase == 'wishlists':
+            cursor = ConferenceApi._migrateWishlistKeys(cursor)
+            if not cursor:
+                phase = None
+        if phase:
+            taskqueue.add(url='/tasks/migrate_session_keys',
+                          params={'phase': phase, 'cursor': cursor or ''})
+        self.response.set_status(204)
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start copying organizer names onto every Conference."""
+        taskqueue.add(url='/tasks/update_organizer_name')
+        self.response.set_status(202)
+
+    def post(self):
+        """Update one batch of Conferences & chain the next one."""
+        organizerUserId = self.request.get('organizerUserId') or None
+        cursor = ConferenceApi._updateOrganizerNames(
+            organizerUserId, self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/update_organizer_name',
+                          params={'organizerUserId': organizerUserId or '',
+                                  'cursor': cursor})
+        self.response.set_status(204)
+
+
+class MigrateRegistrationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving Profile registration lists to Registrations."""
+        taskqueue.add(url='/tasks/migrate_registrations')
+        self.response.set_status(202)
+
+    def post(self):
+        """Migrate one batch of Profiles & chain the next one."""
+        cursor = ConferenceApi._migrateRegistrations(
+            self.request.get('cursor') or None)
+        if cursor:
+            taskqueue.add(url='/tasks/migrate_registrations',
+                          params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class ReindexHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start rebuilding the conference & session search indexes."""
+        for index_name in searchindex.KINDS:
+            taskqueue.add(url='/tasks/reindex', params={'index': index_name})
+        self.response.set_status(202)
+
+    def post(self):
+        """Reindex the given documents, or one batch of an index & chain
+        the next one."""
+        index_name = self.request.get('index')
+        keys = self.request.get('keys')
+        if keys:
+            searchindex.reindex(index_name, keys.split(','))
+        else:
+            cursor = searchindex.reindex_batch(index_name,
+                                               self.request.get('cursor') or None)
+            if cursor:
+                taskqueue.add(url='/tasks/reindex',
+                              params={'index': index_name, 'cursor': cursor})
         self.response.set_status(204)
 
 
+class CountFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recounting every Conference into the facet counters."""
+        taskqueue.add(url='/tasks/count_facets')
+        self.response.set_status(202)
+
+    def post(self):
+        """Count the given Conferences, or queue the counting of one
+        batch & chain the next one."""
+        keys = self.request.get('websafeConferenceKeys')
+        if keys:
+            facets.count_conferences(keys.split(','))
+        else:
+            cursor = facets.recount_batch(self.request.get('cursor') or None)
+            if cursor:
+                taskqueue.add(url='/tasks/count_facets', params={'cursor': cursor})
+        self.response.set_status(204)
+
+
+class ImportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Stream a JSONL/CSV upload of Conferences, Sessions or Profiles
+        into the datastore; re-post with the same job to resume a failed import."""
+        upload = self.request.POST.get('file')
+        stream = getattr(upload, 'file', None) or self.request.body_file
+        fmt = self.request.get('format') or (
+            'csv' if getattr(upload, 'filename', '').endswith('.csv') else 'jsonl')
+        self.response.headers['Content-Type'] = 'application/json'
+        try:
+            job = importer.runImport(self.request.get('job'),
+                                     self.request.get('kind'),
+                                     stream, fmt,
+                                     self.request.get('organizerUserId') or None)
+        except (importer.ImportRowError, ValueError) as e:
+            job = self.request.get('job') and ImportJob.get_by_id(self.request.get('job'))
+            self.response.set_status(400)
+            self.response.write(json.dumps({
+                'error': str(e),
+                'rowsCommitted': job.rowsCommitted if job else 0,
+            }))
+            return
+        self.response.write(json.dumps({
+            'job': job.key.id(),
+            'rowsCommitted': job.rowsCommitted,
+            'entitiesWritten': job.entitiesWritten,
+            'seconds': job.seconds,
+            'entitiesPerSecond': job.entitiesPerSecond,
+        }))
+
+
+class FlushEndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Fold the memcache endpoint counters into the datastore."""
+        instrumentation.flush()
+        self.response.set_status(204)
+
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Report latency percentiles & RPCs per call of each endpoint."""
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(instrumentation.report(), sort_keys=True))
+
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/send_confirmation_digests', SendConfirmationDigestsHandler),
+    ('/crons/flush_endpoint_stats', FlushEndpointStatsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerlHandler),
+    ('/tasks/sync_seats', SyncSeatsHandler),
+    ('/tasks/migrate_session_keys', MigrateSessionKeysHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/reindex', ReindexHandler),
+    ('/tasks/count_facets', CountFacetsHandler),
+    ('/admin/import', ImportHandler),
+    ('/admin/endpoint_stats', EndpointStatsHandler),
 ], debug=True)
@@ -44,9 +44,29 @@ class ProfileForm(messages.Message):
     displayName = messages.StringField(1)
     mainEmail = messages.StringField(2)
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
-    conferenceKeysToAttend = messages.StringField(4, repeated=True)
+    # 4 was conferenceKeysToAttend; registrations are Registration entities
     sessionKeysToAttend = messages.StringField(5, repeated=True)
 
+class ProfileForms(messages.Message):
+    """ProfileForms -- multiple Profile outbound form message"""
+    items = messages.MessageField(ProfileForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class Registration(ndb.Model):
+    """Registration -- a Profile's seat at a Conference; child of the Profile,
+    keyed by the websafe Conference key"""
+    conferenceKey = ndb.KeyProperty(kind='Conference')
+    created       = ndb.DateTimeProperty(auto_now_add=True)
+
+class EndpointStats(ndb.Model):
+    """EndpointStats -- flushed latency & RPC totals of one API method"""
+    calls   = ndb.IntegerProperty(default=0, indexed=False)
+    totalMs = ndb.IntegerProperty(default=0, indexed=False)
+    rpcs    = ndb.JsonProperty()
+    buckets = ndb.IntegerProperty(repeated=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
@@ -69,6 +89,45 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0)
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+    featuredSpeaker = ndb.StringProperty(indexed=False)
+
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats"""
+    seats = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FacetCount(ndb.Model):
+    """FacetCount -- number of Conferences with one city, topic or month"""
+    facet = ndb.StringProperty(indexed=False)
+    value = ndb.StringProperty(indexed=False)
+    count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class CountedFacets(ndb.Model):
+    """CountedFacets -- the FacetCounts a Conference is counted in; a child of the Conference"""
+    facetIds = ndb.StringProperty(repeated=True, indexed=False)
+
+
+class ImportJob(ndb.Model):
+    """ImportJob -- checkpoint of a bulk Conference/Session/Profile import"""
+    kind              = ndb.StringProperty()
+    rowsCommitted     = ndb.IntegerProperty(default=0)
+    entitiesWritten   = ndb.IntegerProperty(default=0)
+    pendingKeys       = ndb.StringProperty(repeated=True, indexed=False)
+    seconds           = ndb.FloatProperty(default=0.0)
+    entitiesPerSecond = ndb.FloatProperty()
+    done              = ndb.BooleanProperty(default=False)
+    updated           = ndb.DateTimeProperty(auto_now=True)
+
+
+class NearlySoldOut(ndb.Model):
+    """NearlySoldOut -- the few Conferences with 1-5 seats left; a single
+    entity updated as seatsAvailable crosses that range"""
+    conferenceKeys  = ndb.StringProperty(repeated=True, indexed=False)
+    conferenceNames = ndb.StringProperty(repeated=True, indexed=False)
 
 
 class ConferenceForm(messages.Message):
@@ -89,6 +148,20 @@ class ConferenceForm(messages.Message):
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- a filter value & how many Conferences have it"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+
+class FacetsForm(messages.Message):
+    """FacetsForm -- outbound city, topic & month filter values"""
+    cities = messages.MessageField(FacetValueForm, 1, repeated=True)
+    topics = messages.MessageField(FacetValueForm, 2, repeated=True)
+    months = messages.MessageField(FacetValueForm, 3, repeated=True)
 
 
 class TeeShirtSize(messages.Enum):
@@ -120,6 +193,8 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
 
 
 class Session(ndb.Model):
@@ -134,6 +209,28 @@ class Session(ndb.Model):
     startTime  = ndb.TimeProperty()
     websafeConferenceKey = ndb.StringProperty(required=True)
     conferenceName = ndb.StringProperty()
+    # derived from typeOfSession/startTime when the session is written
+    isWorkshop = ndb.BooleanProperty()
+    dayPart    = ndb.StringProperty()
+    isEvening  = ndb.BooleanProperty()
+    speakerKey = ndb.KeyProperty(kind='Speaker')
+    # set until the featured speaker refresh has counted the session
+    speakerPending = ndb.BooleanProperty()
+
+class Speaker(ndb.Model):
+    """Speaker -- a speaker across all Conferences, keyed by normalized name"""
+    name        = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+class MovedSession(ndb.Model):
+    """MovedSession -- forwarding record for a re-keyed Session, keyed by
+    the old websafe key"""
+    newKey = ndb.KeyProperty(indexed=False)
+
+class ConferenceSpeaker(ndb.Model):
+    """ConferenceSpeaker -- a speaker's sessions within one Conference"""
+    sessionKeys  = ndb.StringProperty(repeated=True, indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
 
 class SessionForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -147,6 +244,7 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
 
 class SessionQueryForm(messages.Message):
     """ConferenceQueryForm -- Session query inbound form message"""
@@ -156,4 +254,6 @@ class SessionQueryForm(messages.Message):
 
 class SessionQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
-    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
\ No newline at end of file
+    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2, variant=messages.Variant.INT32)
+    pageToken = messages.StringField(3)
\ No newline at end of file
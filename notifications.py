@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""notifications.py
+
+Conference creation confirmations go on the confirmation-email pull queue
+instead of being mailed one push task at a time. A cron worker leases them
+in batches, folds each recipient's notifications into one digest email and
+sends the digests a few at a time.
+
+"""
+
+import json
+import logging
+import threading
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+CONFIRMATION_QUEUE = 'confirmation-email'
+LEASE_SECONDS = 120
+LEASE_BATCH_SIZE = 500
+MAX_BATCHES = 10
+MAX_CONCURRENT_SENDS = 8
+
+SINGLE_SUBJECT = 'You created a new Conference!'
+DIGEST_SUBJECT = 'You created %d new Conferences!'
+SINGLE_BODY = 'Hi, you have created a following conference:\r\n\r\n%s'
+DIGEST_BODY = 'Hi, you have created the following conferences:\r\n\r\n%s'
+
+
+def confirmation_task(email, conferenceInfo):
+    """Return the pull task carrying one creation confirmation."""
+    return taskqueue.Task(method='PULL', tag=email,
+                          payload=json.dumps({'email': email,
+                                              'conferenceInfo': conferenceInfo}))
+
+
+def send_confirmation(email, conferenceInfos):
+    """Mail one recipient a confirmation covering conferenceInfos."""
+    if len(conferenceInfos) == 1:
+        subject, body = SINGLE_SUBJECT, SINGLE_BODY % conferenceInfos[0]
+    else:
+        subject = DIGEST_SUBJECT % len(conferenceInfos)
+        body = DIGEST_BODY % '\r\n\r\n'.join(conferenceInfos)
+    mail.send_mail(
+        'noreply@%s.appspotmail.com' % (
+            app_identity.get_application_id()),     # from
+        email,                                      # to
+        subject,                                    # subj
+        body                                        # body
+    )
+
+
+def _sendDigests(digests):
+    """Send {email: [(task, info)]} with at most MAX_CONCURRENT_SENDS mail
+    calls in flight; returns the task lists of the digests that went out."""
+    pending = list(digests.items())
+    sent = []
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                email, items = pending.pop()
+            try:
+                send_confirmation(email, [info for task, info in items])
+            except Exception:
+                # left leased; the tasks come back when the lease expires
+                logging.exception('confirmation digest to %s failed', email)
+                continue
+            with lock:
+                sent.append([task for task, info in items])
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(MAX_CONCURRENT_SENDS, len(pending)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sent
+
+
+def send_digests(max_batches=MAX_BATCHES):
+    """Lease queued confirmations & mail them as per-recipient digests.
+
+    Returns a dict with the notifications handled and the messages sent,
+    so callers can report how many notifications each message covered.
+    """
+    queue = taskqueue.Queue(CONFIRMATION_QUEUE)
+    stats = {'batches': 0, 'notifications': 0, 'messagesSent': 0}
+    for _ in range(max_batches):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH_SIZE)
+        if not tasks:
+            break
+        digests = {}
+        for task in tasks:
+            data = json.loads(task.payload)
+            digests.setdefault(data['email'], []).append((task, data['conferenceInfo']))
+        sent = _sendDigests(digests)
+        done = [task for digest in sent for task in digest]
+        if done:
+            queue.delete_tasks(done)
+        stats['batches'] += 1
+        stats['notifications'] += len(done)
+        stats['messagesSent'] += len(sent)
+        if len(tasks) < LEASE_BATCH_SIZE:
+            break
+    return stats
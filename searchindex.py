@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+"""searchindex.py
+
+Full-text search over Conferences and Sessions with the Search API. A
+document is written for each Conference (name, description, topics, city)
+and Session (name, highlights, speaker) when it is created or updated; its
+doc_id is the entity's websafe key, so search results are read back from
+the datastore by key. A put that fails is retried from a task, so a write
+never fails because of the index.
+
+"""
+
+import logging
+
+from google.appengine.api import search
+from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
+
+from models import Conference
+from models import Session
+
+import unitofwork
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+KINDS = {
+    CONFERENCE_INDEX: Conference,
+    SESSION_INDEX: Session,
+}
+REINDEX_BATCH_SIZE = 100
+# how many matches are ranked by score before paging over them
+MAX_SORTED_RESULTS = 1000
+
+_SORT_OPTIONS = search.SortOptions(
+    match_scorer=search.MatchScorer(),
+    expressions=[search.SortExpression(
+        expression='_score',
+        direction=search.SortExpression.DESCENDING,
+        default_value=0.0)],
+    limit=MAX_SORTED_RESULTS)
+
+
+def conference_document(conf):
+    """Return the search Document of a Conference."""
+    return search.Document(doc_id=conf.key.urlsafe(), fields=[
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description),
+        search.TextField(name='topics', value=' '.join(conf.topics or [])),
+        search.TextField(name='city', value=conf.city),
+    ])
+
+
+def session_document(session):
+    """Return the search Document of a Session; websafeConferenceKey is an
+    atom so a search can be narrowed to one conference."""
+    return search.Document(doc_id=session.key.urlsafe(), fields=[
+        search.TextField(name='name', value=session.name),
+        search.TextField(name='highlights', value=session.highlights),
+        search.TextField(name='speaker', value=session.speaker),
+        search.AtomField(name='websafeConferenceKey', value=session.websafeConferenceKey),
+    ])
+
+
+DOCUMENTS = {
+    CONFERENCE_INDEX: conference_document,
+    SESSION_INDEX: session_document,
+}
+
+
+def _chunks(items):
+    size = search.MAXIMUM_DOCUMENTS_PER_PUT_REQUEST
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _scheduleReindex(index_name, doc_ids):
+    """Retry indexing doc_ids from a task."""
+    unitofwork.enqueue(unitofwork.task(
+        '/tasks/reindex', params={'index': index_name, 'keys': ','.join(doc_ids)}))
+
+
+def _put(index_name, entities):
+    index = search.Index(name=index_name)
+    for chunk in _chunks([DOCUMENTS[index_name](e) for e in entities]):
+        try:
+            index.put(chunk)
+        except search.Error:
+            logging.exception('indexing %d documents in %s failed', len(chunk), index_name)
+            _scheduleReindex(index_name, [doc.doc_id for doc in chunk])
+
+
+def _delete(index_name, doc_ids):
+    index = search.Index(name=index_name)
+    for chunk in _chunks(list(doc_ids)):
+        try:
+            index.delete(chunk)
+        except search.Error:
+            # reindex() drops documents whose entity is gone
+            logging.exception('deleting %d documents from %s failed', len(chunk), index_name)
+            _scheduleReindex(index_name, chunk)
+
+
+def index_conferences(conferences):
+    """Write the documents of Conferences that were created or updated."""
+    _put(CONFERENCE_INDEX, [c for c in conferences if c])
+
+
+def index_sessions(sessions, replaced=()):
+    """Write the documents of new Sessions; replaced are the keys of
+    Sessions they were copied from, whose documents are dropped."""
+    _put(SESSION_INDEX, [s for s in sessions if s])
+    if replaced:
+        _delete(SESSION_INDEX, [k.urlsafe() for k in replaced])
+
+
+def reindex(index_name, websafeKeys):
+    """Rewrite the documents of websafeKeys from the datastore, dropping
+    those whose entity no longer exists."""
+    keys = [ndb.Key(urlsafe=k) for k in websafeKeys]
+    entities = ndb.get_multi(keys)
+    _put(index_name, [e for e in entities if e])
+    gone = [k.urlsafe() for k, e in zip(keys, entities) if not e]
+    if gone:
+        _delete(index_name, gone)
+
+
+def reindex_batch(index_name, websafeCursor=None):
+    """Index one batch of every entity of the index's kind; returns the
+    cursor of the next batch or None when done."""
+    model = KINDS[index_name]
+    cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    entities, next_cursor, more = model.query().order(model.key).fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=cursor)
+    _put(index_name, entities)
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+    return None
+
+
+def search_keys(index_name, query_string, page_size, page_token=None):
+    """Run a query against an index, best matches first.
+
+    Returns (entity keys of one page, token of the next page or None).
+    Raises ValueError for a malformed query or page token.
+    """
+    try:
+        cursor = search.Cursor(web_safe_string=page_token) if page_token else search.Cursor()
+        options = search.QueryOptions(limit=page_size, cursor=cursor, ids_only=True,
+                                      sort_options=_SORT_OPTIONS)
+        results = search.Index(name=index_name).search(
+            search.Query(query_string=query_string, options=options))
+    except (search.QueryError, search.InvalidRequest) as e:
+        raise ValueError(str(e))
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    next_token = results.cursor.web_safe_string if results.cursor else None
+    return keys, next_token
+
+
+def quote(value):
+    """Quote a value for use as a phrase in a query string."""
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Sharded seat counters for Conference registration. Each Conference's
+available seats are spread over NUM_SHARDS root SeatShard entities so that
+concurrent registrations write to different entity groups instead of all
+contending on the Conference itself.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import SeatShard
+
+import unitofwork
+
+NUM_SHARDS = 20
+MEMCACHE_SEATS_KEY = "SEATS_AVAILABLE:%s"
+SEATS_CACHE_TTL = 60
+SYNC_WINDOW = 10
+
+
+def shard_keys(conf_key, num_shards=NUM_SHARDS):
+    """Return the SeatShard keys belonging to a Conference."""
+    prefix = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (prefix, i))
+            for i in range(num_shards)]
+
+
+def new_shards(conf_key, seats, num_shards=NUM_SHARDS):
+    """Return unsaved SeatShards splitting seats evenly over the shards."""
+    base, extra = divmod(max(seats or 0, 0), num_shards)
+    return [SeatShard(key=key, seats=base + (1 if i < extra else 0))
+            for i, key in enumerate(shard_keys(conf_key, num_shards))]
+
+
+@ndb.transactional(xg=True)
+def _initShards(conf_key):
+    conf = conf_key.get()
+    if not conf.seatShards:
+        conf.seatShards = NUM_SHARDS
+        ndb.put_multi([conf] + new_shards(conf_key, conf.seatsAvailable))
+    return conf
+
+
+def ensure_shards(conf):
+    """Shard the seats of a Conference created before sharding existed."""
+    if conf.seatShards:
+        return conf
+    return _initShards(conf.key)
+
+
+def candidate_shards(conf):
+    """Return shard keys that had seats left, in random order."""
+    conf = ensure_shards(conf)
+    keys = shard_keys(conf.key, conf.seatShards)
+    shards = ndb.get_multi(keys, use_cache=False, use_memcache=False)
+    candidates = [s.key for s in shards if s and s.seats > 0]
+    random.shuffle(candidates)
+    return candidates
+
+
+def random_shard(conf):
+    """Return the key of any one shard of a Conference."""
+    conf = ensure_shards(conf)
+    return random.choice(shard_keys(conf.key, conf.seatShards))
+
+
+def adjust_shards(conf, delta):
+    """Add (or take away) delta seats across a Conference's shards.
+
+    Must run inside a cross-group transaction. Seats that are already
+    taken can't be removed, so a shrinking conference never goes below
+    zero seats available. Returns the new total.
+    """
+    shards = ndb.get_multi(shard_keys(conf.key, conf.seatShards))
+    if delta >= 0:
+        base, extra = divmod(delta, len(shards))
+        for i, shard in enumerate(shards):
+            shard.seats += base + (1 if i < extra else 0)
+    else:
+        remaining = -delta
+        for shard in shards:
+            taken = min(shard.seats, remaining)
+            shard.seats -= taken
+            remaining -= taken
+    ndb.put_multi(shards)
+    memcache.delete(MEMCACHE_SEATS_KEY % conf.key.urlsafe())
+    return sum(shard.seats for shard in shards)
+
+
+def count_seats(conf):
+    """Return the exact number of seats available, summed over the shards."""
+    if not conf.seatShards:
+        return conf.seatsAvailable
+    key = MEMCACHE_SEATS_KEY % conf.key.urlsafe()
+    seats = memcache.get(key)
+    if seats is None:
+        shards = ndb.get_multi(shard_keys(conf.key, conf.seatShards))
+        seats = sum(s.seats for s in shards if s)
+        memcache.add(key, seats, time=SEATS_CACHE_TTL)
+    return seats
+
+
+def cached_seats(confs):
+    """Return {conference key: seats available} without touching shards.
+
+    Uses the cached shard sums where present and falls back to the
+    (periodically synced) Conference.seatsAvailable property otherwise.
+    """
+    keys = dict((MEMCACHE_SEATS_KEY % conf.key.urlsafe(), conf) for conf in confs)
+    cached = memcache.get_multi(keys.keys())
+    seats = {}
+    for key, conf in keys.items():
+        seats[conf.key] = cached.get(key, conf.seatsAvailable)
+    return seats
+
+
+def seat_taken(conf_key):
+    """Update the cached sum after a seat was taken."""
+    memcache.decr(MEMCACHE_SEATS_KEY % conf_key.urlsafe())
+    _scheduleSync(conf_key)
+
+
+def seat_released(conf_key):
+    """Update the cached sum after a seat was given back."""
+    memcache.incr(MEMCACHE_SEATS_KEY % conf_key.urlsafe())
+    _scheduleSync(conf_key)
+
+
+def _scheduleSync(conf_key):
+    """Enqueue at most one seatsAvailable sync per conference per window."""
+    wsck = conf_key.urlsafe()
+    unitofwork.enqueue(unitofwork.task(
+        '/tasks/sync_seats',
+        params={'websafeConferenceKey': wsck},
+        name='sync-seats-%s-%d' % (wsck, int(time.time() / SYNC_WINDOW)),
+        countdown=SYNC_WINDOW))
+
+
+@ndb.transactional()
+def _storeSeats(conf_key, seats):
+    conf = conf_key.get()
+    if conf and conf.seatsAvailable != seats:
+        conf.seatsAvailable = seats
+        conf.put()
+    return conf
+
+
+def sync_seats(conf_key):
+    """Write the shard sum back to Conference.seatsAvailable for queries;
+    returns the updated Conference.
+    """
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return conf
+    shards = ndb.get_multi(shard_keys(conf_key, conf.seatShards))
+    seats = sum(s.seats for s in shards if s)
+    conf = _storeSeats(conf_key, seats)
+    memcache.set(MEMCACHE_SEATS_KEY % conf_key.urlsafe(), seats, time=SEATS_CACHE_TTL)
+    return conf
@@ -293,6 +293,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the token for the next page of conferences returned by queryConferences, if any.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
+    /**
+     * Holds the city, topic and month filter values with the number of conferences having each.
+     * @type {Object}
+     */
+    $scope.facets = null;
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -305,6 +317,9 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.tabAllSelected = function () {
         $scope.selectedTab = 'ALL';
+        if (!$scope.facets) {
+            $scope.getConferenceFacets();
+        }
         $scope.queryConferences();
     };
 
@@ -390,6 +405,30 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         })
     };
 
+    /**
+     * Replaces the filters on a field with an equality filter on value and runs the query.
+     *
+     * @param enumValue the field to filter on
+     * @param value the value to filter for
+     */
+    $scope.filterByFacet = function (enumValue, value) {
+        var field;
+        angular.forEach($scope.filtereableFields, function (f) {
+            if (f.enumValue == enumValue) {
+                field = f;
+            }
+        });
+        $scope.filters = $scope.filters.filter(function (filter) {
+            return filter.field.enumValue != enumValue;
+        });
+        $scope.filters.push({
+            field: field,
+            operator: $scope.operators[0],
+            value: value
+        });
+        $scope.queryConferences();
+    };
+
     /**
      * Clears all filters.
      */
@@ -414,6 +453,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.queryConferences = function () {
         $scope.submitted = false;
+        $scope.nextPageToken = null;
         if ($scope.selectedTab == 'ALL') {
             $scope.queryConferencesAll();
         } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
@@ -426,9 +466,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
     /**
      * Invokes the conference.queryConferences API.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (pageToken) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize
+        }
+        if (pageToken) {
+            sendFilters.pageToken = pageToken;
         }
         for (var i = 0; i < $scope.filters.length; i++) {
             var filter = $scope.filters[i];
@@ -458,16 +502,55 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
+                        if (!pageToken) {
+                            $scope.conferences = [];
+                            $scope.pagination.currentPage = 0;
+                        }
                         angular.forEach(resp.items, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken;
+                        if (pageToken) {
+                            $scope.pagination.currentPage = $scope.pagination.numberOfPages() - 1;
+                        }
                     }
                     $scope.submitted = true;
                 });
             });
     }
 
+    /**
+     * Invokes the conference.getConferenceFacets API.
+     */
+    $scope.getConferenceFacets = function () {
+        gapi.client.conference.getConferenceFacets().
+            execute(function (resp) {
+                $scope.$apply(function () {
+                    if (resp.error) {
+                        // The request has failed.
+                        var errorMessage = resp.error.message || '';
+                        $log.error('Failed to get the conference facets : ' + errorMessage);
+                    } else {
+                        // The request has succeeded.
+                        $scope.facets = {
+                            cities: resp.result.cities || [],
+                            topics: resp.result.topics || [],
+                            months: resp.result.months || []
+                        };
+                    }
+                });
+            });
+    };
+
+    /**
+     * Fetches the next page of conferences from the server using the token of the last query.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.nextPageToken) {
+            $scope.queryConferencesAll($scope.nextPageToken);
+        }
+    };
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
@@ -581,21 +664,18 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
 
         $scope.loading = true;
         // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
+        gapi.client.conference.isRegisteredForConference({
+            websafeConferenceKey: $routeParams.websafeConferenceKey
+        }).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
                 if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
-                    }
+                    // Failed to get the registration status.
+                } else if (resp.result.data) {
+                    // The user is attending the conference.
+                    $scope.alertStatus = 'info';
+                    $scope.messages = 'You are attending this conference';
+                    $scope.isUserAttending = true;
                 }
             });
         });
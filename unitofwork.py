@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""unitofwork.py
+
+Request-scoped unit of work for ConferenceApi endpoints. Entities read
+through it are kept in an identity map, so a request reads each one once.
+Writes are not deferred; they go straight to the datastore, in
+transactions where they need to be.
+
+Tasks for side effects are collected for the request and added with
+add_async when the endpoint returns (or earlier, via flush()), overlapped
+with the rest of the request. Tasks made with task() are named after the
+entity they are about so repeats collapse; inside a transaction they are
+added transactionally instead.
+
+"""
+
+import functools
+import hashlib
+import re
+import threading
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+VALID_TASK_NAME = re.compile(r'^[a-zA-Z0-9_-]{1,500}$')
+
+_local = threading.local()
+
+
+class UnitOfWork(object):
+    """UnitOfWork -- identity map & collected tasks for one API request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.loaded = {}
+        self.tasks = {}
+        self.taskRpcs = []
+
+    def get_multi(self, keys):
+        """Return entities for keys, fetching only those not yet loaded."""
+        missing = [k for k in set(keys) if k not in self.loaded]
+        if missing:
+            for key, entity in zip(missing, ndb.get_multi(missing)):
+                self.loaded[key] = entity
+        return [self.loaded[k] for k in keys]
+
+    def flush(self):
+        """Start adding the collected tasks."""
+        for queue_name, tasks in self.tasks.items():
+            self.taskRpcs.extend(_addAsync(tasks, queue_name))
+        self.tasks = {}
+
+    def finish(self):
+        """Flush & wait for the tasks to be added."""
+        self.flush()
+        _wait(self.taskRpcs)
+
+
+def current():
+    """Return the UnitOfWork of the running request, if any."""
+    return getattr(_local, 'uow', None)
+
+
+def get_multi(keys):
+    """ndb.get_multi through the current unit of work, when there is one."""
+    uow = current()
+    if uow is None or ndb.in_transaction():
+        return ndb.get_multi(keys)
+    return uow.get_multi(keys)
+
+
+def get(key):
+    return get_multi([key])[0]
+
+
+def task(url, params=None, name=None, **kwargs):
+    """Return a Task for enqueue(). name identifies the entity the task is
+    about; tasks with the same name are only added once. Tasks made inside
+    a transaction are left unnamed since they are added transactionally.
+    """
+    if name and not ndb.in_transaction():
+        if not VALID_TASK_NAME.match(name):
+            if isinstance(name, unicode):
+                name = name.encode('utf-8')
+            name = hashlib.sha1(name).hexdigest()
+        kwargs['name'] = name
+    return taskqueue.Task(url=url, params=params, **kwargs)
+
+
+def _addAsync(tasks, queue_name='default'):
+    """Start adding tasks to a queue; returns the RPCs."""
+    queue = taskqueue.Queue(queue_name)
+    # a batch may not name the same task twice
+    names = set()
+    unique = []
+    for task in tasks:
+        if not task.name or task.name not in names:
+            names.add(task.name)
+            unique.append(task)
+    tasks = unique
+    # Queue.add takes at most MAX_TASKS_PER_ADD tasks per call
+    return [queue.add_async(tasks[i:i + taskqueue.MAX_TASKS_PER_ADD])
+            for i in range(0, len(tasks), taskqueue.MAX_TASKS_PER_ADD)]
+
+
+def _wait(rpcs):
+    for rpc in rpcs:
+        try:
+            rpc.get_result()
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError,
+                taskqueue.DuplicateTaskNameError):
+            # a task of the same name was already added
+            pass
+
+
+def enqueue(*tasks, **kwargs):
+    """Add tasks to a queue (queue_name=, default 'default'). Inside a
+    transaction they are added transactionally, so they only run if it
+    commits. Otherwise they are added when the request flushes, or right
+    away when there is no unit of work.
+    """
+    queue_name = kwargs.pop('queue_name', 'default')
+    if ndb.in_transaction():
+        # the add has to finish before the transaction commits
+        taskqueue.Queue(queue_name).add(list(tasks), transactional=True)
+        return
+    uow = current()
+    if uow is None:
+        _wait(_addAsync(list(tasks), queue_name))
+    else:
+        uow.tasks.setdefault(queue_name, []).extend(tasks)
+
+
+def flush():
+    """Start adding the collected tasks now so they overlap with building
+    the response; the endpoint still waits for them before returning."""
+    uow = current()
+    if uow is not None:
+        uow.flush()
+
+
+def endpoint(method):
+    """Run an API method in its own unit of work. Collected tasks are
+    dropped if the method raises."""
+
+    @functools.wraps(method)
+    def wrapper(self, request):
+        uow = _local.uow = UnitOfWork(method.__name__)
+        try:
+            response = method(self, request)
+            uow.finish()
+            return response
+        finally:
+            _local.uow = None
+    return wrapper
+
@@ -1,11 +1,90 @@
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
 from models import Profile
 
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+MEMCACHE_TOKEN_KEY = "TOKENINFO:%s"
+DEFAULT_TOKEN_TTL = 60
+MAX_TOKEN_TTL = 3600
+MAX_CACHED_TOKENS = 10000
+
+# token digest -> (user_id, expires_at); user_id '' marks an invalid token
+_tokenCache = {}
+# token digest -> threading.Event set once the lookup in flight finishes
+_tokenLookups = {}
+_tokenLock = threading.Lock()
+
+
+def _fetchTokenInfo(token, token_type):
+    """Ask tokeninfo about a token; return (user_id, seconds to cache it)."""
+    url = TOKENINFO_URL % (token_type, token)
+    wait = 0.1
+    for i in range(3):
+        resp = urlfetch.fetch(url, deadline=5)
+        if resp.status_code == 200:
+            user = json.loads(resp.content)
+            ttl = int(user.get('expires_in', DEFAULT_TOKEN_TTL))
+            return user.get('user_id', ''), min(ttl, MAX_TOKEN_TTL)
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            if token_type == 'access_token':
+                # known bad token; remember that for a little while
+                return '', DEFAULT_TOKEN_TTL
+            token_type = 'access_token'
+            url = TOKENINFO_URL % (token_type, token)
+        else:
+            time.sleep(wait)
+            wait = wait * 2
+    # tokeninfo kept failing; don't cache a transient error
+    return '', 0
+
+
+def _verifyToken(token, token_type):
+    """Return the user_id for a token, caching the answer until it expires."""
+    digest = hashlib.sha1(token).hexdigest()
+    cached = _tokenCache.get(digest)
+    if cached and cached[1] > time.time():
+        return cached[0]
+
+    cached = memcache.get(MEMCACHE_TOKEN_KEY % digest)
+    if cached and cached[1] > time.time():
+        _tokenCache[digest] = cached
+        return cached[0]
+
+    # only one thread per instance asks tokeninfo about a given token
+    with _tokenLock:
+        lookup = _tokenLookups.get(digest)
+        leader = lookup is None
+        if leader:
+            lookup = _tokenLookups[digest] = threading.Event()
+    if not leader:
+        lookup.wait(10)
+        cached = _tokenCache.get(digest)
+        if cached and cached[1] > time.time():
+            return cached[0]
+
+    try:
+        user_id, ttl = _fetchTokenInfo(token, token_type)
+        if ttl > 0:
+            if len(_tokenCache) >= MAX_CACHED_TOKENS:
+                _tokenCache.clear()
+            cached = (user_id, time.time() + ttl)
+            _tokenCache[digest] = cached
+            memcache.set(MEMCACHE_TOKEN_KEY % digest, cached, time=ttl)
+        return user_id
+    finally:
+        if leader:
+            with _tokenLock:
+                _tokenLookups.pop(digest, None)
+            lookup.set()
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -17,22 +96,7 @@ def getUserId(user, id_type="email"):
         token_type = 'id_token'
         if 'OAUTH_USER_ID' in os.environ:
             token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _verifyToken(token, token_type)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm